@@ -0,0 +1,911 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pandas as pd
+import numpy as np
+import datetime
+import itertools
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class metrics:
+    enabled = False
+    sink = None
+    counters = {}
+    timers = {}
+    lock = threading.Lock()
+    # request errors carry their URL, apiToken included, so the values of
+    # every query string are masked before they reach the log
+    query = re.compile(r"([?&][^=?&\s'\"]+=)[^&\s'\"]*")
+
+    @classmethod
+    def enable(cls, sink=None):
+        cls.sink = sink
+        cls.enabled = True
+
+    @classmethod
+    def disable(cls):
+        cls.enabled = False
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.counters.clear()
+            cls.timers.clear()
+
+    @classmethod
+    def count(cls, name, value=1):
+        if not cls.enabled:
+            return
+        with cls.lock:
+            cls.counters[name] = cls.counters.get(name, 0) + value
+        if cls.sink is not None:
+            cls.sink(name, value)
+
+    @classmethod
+    def start(cls):
+        # call sites pay for the clock only while metrics are switched on
+        return time.perf_counter() if cls.enabled else None
+
+    @classmethod
+    def stop(cls, name, start):
+        if start is not None:
+            cls.observe(name, time.perf_counter() - start)
+
+    @classmethod
+    def observe(cls, name, seconds):
+        if not cls.enabled:
+            return
+        with cls.lock:
+            timer = cls.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+        if cls.sink is not None:
+            cls.sink(name, seconds)
+
+    @classmethod
+    def lag(cls, name, message):
+        # seconds between the exchange trade of a REST quote and its
+        # arrival here
+        if not cls.enabled:
+            return
+        at = (message.get("trade") or {}).get("at")
+        if at is not None:
+            at = datetime.datetime.strptime(at, "%Y-%m-%dT%H:%M:%S.%fZ")
+            at = at.replace(tzinfo=datetime.timezone.utc)
+            cls.observe(name, time.time() - at.timestamp())
+
+    @classmethod
+    def error(cls, where, error):
+        logger.warning("%s: %s", where, cls.query.sub(r"\1***", repr(error)))
+        if cls.enabled:
+            cls.count('errors_total{where="%s"}' % where)
+
+    @staticmethod
+    def series(name, suffix):
+        base, brace, labels = name.partition("{")
+        return base + suffix + brace + labels
+
+    @classmethod
+    def to_prometheus(cls):
+        with cls.lock:
+            counters = sorted(cls.counters.items())
+            timers = sorted(cls.timers.items())
+
+        lines = ["%s %s" % (name, value) for name, value in counters]
+        for name, (count, total, peak) in timers:
+            lines.append("%s %d" % (cls.series(name, "_count"), count))
+            lines.append("%s %.9f" % (cls.series(name, "_sum"), total))
+            lines.append("%s %.9f" % (cls.series(name, "_max"), peak))
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def serve(cls, app, path="/metrics"):
+        # the Dash app's own flask server answers Prometheus scrapes
+        app.server.add_url_rule(
+            path,
+            "metrics",
+            lambda: (
+                cls.to_prometheus(),
+                200,
+                {"Content-Type": "text/plain; version=0.0.4"},
+            ),
+        )
+
+
+class session_calendar:
+    session_minutes = 270
+    instances = {}
+    instances_lock = threading.Lock()
+
+    def __init__(self, date, n):
+        self.date = date
+        self.n = n
+        self.size = -(-self.session_minutes // n)
+
+        open_time = datetime.datetime(date.year, date.month, date.day, 9, 0)
+        close_time = datetime.datetime(date.year, date.month, date.day, 13, 30)
+
+        time_index = pd.date_range(
+            start=open_time + datetime.timedelta(minutes=n),
+            periods=self.size,
+            freq=f"{n}T",
+        )
+        self.time_index = time_index.where(
+            time_index <= close_time, close_time
+        )
+        self.labels = self.time_index.astype(str)
+
+    @classmethod
+    def get(cls, n, date=None):
+        date = date or datetime.date.today()
+
+        with cls.instances_lock:
+            if (date, n) not in cls.instances:
+                # grids of stored days are asked for now and then, so the
+                # memo is only bounded instead of kept to today
+                if len(cls.instances) >= 64:
+                    cls.instances.clear()
+                cls.instances[(date, n)] = cls(date, n)
+            return cls.instances[(date, n)]
+
+
+class sma:
+    def __init__(self, size, window):
+        self.window = window
+        self.values = {"sma": np.full(size, np.nan)}
+        # the window sum after every bar, so an update resumes from the
+        # first changed bar in O(1) per bar
+        self.total = np.zeros(size)
+        self.count = np.zeros(size, dtype=int)
+
+    def update(self, bars, start, stop):
+        close = bars["close"]
+        values = self.values["sma"]
+
+        if start > 0:
+            total, count = self.total[start - 1], self.count[start - 1]
+        else:
+            total, count = 0.0, 0
+
+        for k in range(start, stop):
+            if k >= self.window:
+                y = close[k - self.window]
+                if y == y:
+                    total -= y
+                    count -= 1
+            x = close[k]
+            if x == x:
+                if count == 0:
+                    total = 0.0
+                total += x
+                count += 1
+
+            # a window with a missing bar is NaN, as rolling(window) is
+            values[k] = total / count if count == self.window else np.nan
+            self.total[k] = total
+            self.count[k] = count
+
+
+class bollinger:
+    def __init__(self, size, window, width=2):
+        self.window = window
+        self.width = width
+        self.values = {
+            "mid": np.full(size, np.nan),
+            "upper": np.full(size, np.nan),
+            "lower": np.full(size, np.nan),
+        }
+        # running sum and sum of squares of the window, taken around the
+        # first close in it so the variance does not cancel out
+        self.total = np.zeros(size)
+        self.squares = np.zeros(size)
+        self.count = np.zeros(size, dtype=int)
+        self.shift = np.zeros(size)
+        # bars in a row with the same close, whose band is exactly flat
+        self.run = np.zeros(size, dtype=int)
+
+    def update(self, bars, start, stop):
+        close = bars["close"]
+        mid, upper, lower = (
+            self.values["mid"],
+            self.values["upper"],
+            self.values["lower"],
+        )
+
+        if start > 0:
+            total = self.total[start - 1]
+            squares = self.squares[start - 1]
+            count = self.count[start - 1]
+            shift = self.shift[start - 1]
+            run = self.run[start - 1]
+        else:
+            total, squares, count, shift, run = 0.0, 0.0, 0, 0.0, 0
+
+        for k in range(start, stop):
+            if k >= self.window:
+                y = close[k - self.window]
+                if y == y:
+                    total -= y - shift
+                    squares -= (y - shift) ** 2
+                    count -= 1
+            x = close[k]
+            if x == x:
+                if count == 0:
+                    total, squares, shift = 0.0, 0.0, x
+                total += x - shift
+                squares += (x - shift) ** 2
+                count += 1
+                run = run + 1 if k > 0 and close[k - 1] == x else 1
+            else:
+                run = 0
+
+            if count == self.window:
+                mean = total / count
+                if count < 2:
+                    std = np.nan
+                elif run >= count:
+                    std = 0.0
+                else:
+                    std = np.sqrt(
+                        max(squares - total * mean, 0.0) / (count - 1)
+                    )
+                mid[k] = shift + mean
+                upper[k] = mid[k] + self.width * std
+                lower[k] = mid[k] - self.width * std
+            else:
+                mid[k] = upper[k] = lower[k] = np.nan
+
+            self.total[k] = total
+            self.squares[k] = squares
+            self.count[k] = count
+            self.shift[k] = shift
+            self.run[k] = run
+
+
+class ema:
+    def __init__(self, size, window):
+        self.alpha = 2 / (window + 1)
+        self.values = {"ema": np.full(size, np.nan)}
+        self.weight = np.ones(size)
+        self.nobs = np.zeros(size, dtype=int)
+
+    def update(self, bars, start, stop):
+        close = bars["close"]
+        values = self.values["ema"]
+
+        if start > 0:
+            avg = values[start - 1]
+            weight = self.weight[start - 1]
+            nobs = self.nobs[start - 1]
+        else:
+            avg, weight, nobs = np.nan, 1.0, 0
+
+        # the same recursion as Series.ewm(span=window, adjust=False), so
+        # missing bars decay the old weight exactly as pandas does
+        for k in range(start, stop):
+            x = close[k]
+            observed = x == x
+            nobs += observed
+
+            if avg == avg:
+                weight *= 1 - self.alpha
+                if observed:
+                    if avg != x:
+                        avg = (weight * avg + self.alpha * x) / (
+                            weight + self.alpha
+                        )
+                    weight = 1.0
+            elif observed:
+                avg = x
+
+            values[k] = avg if nobs else np.nan
+            self.weight[k] = weight
+            self.nobs[k] = nobs
+
+        if stop > 0:
+            values[stop:] = values[stop - 1]
+
+
+class vwap:
+    def __init__(self, size, window=None):
+        self.values = {"vwap": np.full(size, np.nan)}
+        self.amount = np.zeros(size)
+        self.volume = np.zeros(size)
+
+    def update(self, bars, start, stop):
+        close, volume = bars["close"], bars["volume"]
+        values = self.values["vwap"]
+
+        if start > 0:
+            amount, total = self.amount[start - 1], self.volume[start - 1]
+        else:
+            amount, total = 0.0, 0.0
+
+        for k in range(start, stop):
+            x = close[k] * volume[k]
+            if x == x:
+                amount += x
+                total += volume[k]
+                values[k] = amount / total if total else np.nan
+            else:
+                values[k] = np.nan
+            self.amount[k] = amount
+            self.volume[k] = total
+
+
+class bar_store:
+    columns = ["open", "high", "low", "close", "volume"]
+
+    def __init__(self, root, session_minutes=270):
+        self.root = root
+        self.session_minutes = session_minutes
+
+    def path(self, symbol_id, date):
+        return os.path.join(self.root, symbol_id, date + ".npy")
+
+    def open(self, symbol_id, date):
+        path = self.path(symbol_id, date)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # the day is created under a private name and linked into place,
+            # so workers and threads starting together all end up mapping
+            # the same file
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(path), suffix=".tmp"
+            )
+            os.close(fd)
+            data = np.lib.format.open_memmap(
+                tmp,
+                mode="w+",
+                dtype=float,
+                shape=(len(self.columns), self.session_minutes),
+            )
+            data[:] = np.nan
+            data.flush()
+            del data
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+
+        return np.load(path, mmap_mode="r+")
+
+    def dates(self, symbol_id):
+        try:
+            names = os.listdir(os.path.join(self.root, symbol_id))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-4] for name in names if name.endswith(".npy"))
+
+    def mtime(self, symbol_id, date):
+        try:
+            return os.path.getmtime(self.path(symbol_id, date))
+        except FileNotFoundError:
+            return None
+
+    def touch(self, symbol_id, date):
+        os.utime(self.path(symbol_id, date))
+
+
+class bar_builder:
+    session_minutes = 270
+    levels = (1, 5, 10, 15, 30, 60)
+    record_dtype = np.dtype(
+        [
+            ("at", "datetime64[m]"),
+            ("open", float),
+            ("high", float),
+            ("low", float),
+            ("close", float),
+            ("volume", float),
+        ]
+    )
+    indicator_types = {
+        "sma": sma,
+        "ema": ema,
+        "vwap": vwap,
+        "bollinger": bollinger,
+    }
+
+    def __init__(self, store=None):
+        self.lock = threading.RLock()
+        self.store = store
+        self.version = 0
+        self.reset()
+
+    def reset(self, symbol_id=None, date=None):
+        self.symbol_id = symbol_id
+        self.date = date
+        # the minutes of a day in the store live in its memory map, so
+        # every change is on disk without a separate write
+        self.mapped = (
+            self.store is not None
+            and bool(symbol_id and date)
+            and self.store.mtime(symbol_id, date) is not None
+        )
+        if self.mapped:
+            data = self.store.open(symbol_id, date)
+        else:
+            data = np.full((5, self.session_minutes), np.nan)
+        self.open, self.high, self.low, self.close, self.volume = data
+        self.seen = 0
+        self.bars = {}
+        self.dirty = {}
+        self.indicators = {}
+        self.restore()
+
+    def restore(self):
+        # minutes up to the last one are always covered by a close
+        covered = np.flatnonzero(~np.isnan(self.close))
+        self.last = int(covered[-1]) if len(covered) else -1
+        self.loaded = None
+        if self.store is not None and self.date:
+            self.loaded = self.store.mtime(self.symbol_id, self.date)
+        for n in self.dirty:
+            self.dirty[n] = 0
+        # the version keeps counting across days and reloads so a frame or
+        # figure of older minutes can never pass for the current ones
+        self.version += 1
+
+    def load(self, symbol_id, date):
+        # picks up the minutes other workers wrote to the store
+        with self.lock:
+            if symbol_id != self.symbol_id or date != self.date:
+                self.reset(symbol_id, date)
+            elif (
+                self.store is not None
+                and self.store.mtime(symbol_id, date) != self.loaded
+            ):
+                self.reload()
+
+    def reload(self):
+        # a day another worker created is mapped, one it wrote to is
+        # rebuilt from the map
+        if self.mapped:
+            self.restore()
+        else:
+            self.reset(self.symbol_id, self.date)
+
+    def attach(self):
+        # the day file is only created once a real minute arrives, so a
+        # symbol watched on a weekend or holiday leaves no empty day behind
+        data = self.store.open(self.symbol_id, self.date)
+        data[:] = [self.open, self.high, self.low, self.close, self.volume]
+        self.open, self.high, self.low, self.close, self.volume = data
+        self.mapped = True
+
+    def day(self):
+        if not self.date:
+            return None
+        return datetime.datetime.strptime(self.date, "%Y-%m-%d").date()
+
+    def records(self, start=0):
+        # the minutes as one compact array, each stamped with its local
+        # closing minute, so index 0 is 09:01
+        with self.lock:
+            stop = self.last + 1
+            start = min(max(start, 0), max(stop, 0))
+            records = np.empty(stop - start, dtype=self.record_dtype)
+            first = np.datetime64(self.date or "NaT", "m") + 541 + start
+            records["at"] = first + np.arange(stop - start)
+            for col in ["open", "high", "low", "close", "volume"]:
+                records[col] = getattr(self, col)[start:stop]
+
+            return records
+
+    def minute_index(self, at):
+        # chart keys are UTC minutes, e.g. 2020-03-05T01:01:00.000Z is 09:01
+        return int(at[11:13]) * 60 + int(at[14:16]) + 480 - 541
+
+    @staticmethod
+    def check(chart):
+        # an error payload, e.g. {"apiVersion": ..., "error": ...}, is not
+        # keyed by minutes and must never reset the day
+        at = next(iter(chart)) if isinstance(chart, dict) else None
+        try:
+            datetime.datetime.strptime(at, "%Y-%m-%dT%H:%M:%S.%fZ")
+        except (TypeError, ValueError):
+            raise ValueError("not a chart: %r" % (at,)) from None
+
+    def update(self, symbol_id, chart):
+        with self.lock:
+            if not chart:
+                return
+            self.check(chart)
+            date = next(iter(chart))[:10]
+            if symbol_id != self.symbol_id or date != self.date:
+                self.reset(symbol_id, date)
+            elif (
+                self.store is not None
+                and self.store.mtime(symbol_id, date) != self.loaded
+            ):
+                # another worker already wrote minutes to the shared map, so
+                # last and the dirty bars are rebuilt before comparing to it
+                self.reload()
+            version = self.version
+
+            # the newest minute keeps changing until the next one opens, so
+            # resume from it instead of replaying the whole day
+            start = max(self.seen - 1, 0)
+            for at, bar in itertools.islice(chart.items(), start, None):
+                i = self.minute_index(at)
+                if not 0 <= i < self.session_minutes:
+                    continue
+                self.set_minute(i, bar)
+            self.seen = len(chart)
+
+            # readers in other processes tell fresh days by their mtime
+            if self.store is not None and self.version != version:
+                if not self.mapped:
+                    self.attach()
+                self.store.touch(symbol_id, date)
+                self.loaded = self.store.mtime(symbol_id, date)
+
+    def set_minute(self, i, bar):
+        # a minute past last is always taken, even if a worker sharing the
+        # store already wrote the same values, so last and version advance
+        if (
+            i <= self.last
+            and self.open[i] == bar["open"]
+            and self.high[i] == bar["high"]
+            and self.low[i] == bar["low"]
+            and self.close[i] == bar["close"]
+            and self.volume[i] == bar["volume"]
+        ):
+            return
+
+        start = i
+        if self.last >= 0 and i > self.last + 1:
+            # minutes without trades carry the previous close, like asfreq
+            self.close[self.last + 1 : i] = self.close[self.last]
+            self.volume[self.last + 1 : i] = 0
+            start = self.last + 1
+
+        self.open[i] = bar["open"]
+        self.high[i] = bar["high"]
+        self.low[i] = bar["low"]
+        self.close[i] = bar["close"]
+        self.volume[i] = bar["volume"]
+        if i < self.last:
+            j = i + 1
+            while j <= self.last and np.isnan(self.open[j]):
+                self.close[j] = self.close[i]
+                j += 1
+        self.last = max(self.last, i)
+        self.version += 1
+
+        for n in self.dirty:
+            self.dirty[n] = min(self.dirty[n], start // n)
+
+    def aggregate(self, source, r, start, stop, bars):
+        # a bar of a level without trades keeps NaN prices, and one before
+        # the first trade also a NaN close and volume, just like a minute,
+        # so every level aggregates the one below it the same way
+        if start >= stop:
+            return
+        lo, hi = start * r, min(stop * r, len(source["close"]))
+        at = np.arange(0, hi - lo, r)
+        traded = ~np.isnan(source["open"][lo:hi])
+        covered = ~np.isnan(source["close"][lo:hi])
+        index = np.arange(hi - lo)
+
+        first = np.minimum.reduceat(np.where(traded, index, hi), at)
+        last = np.maximum.reduceat(np.where(covered, index, -1), at)
+        opened = first < hi
+        closed = last >= 0
+
+        bars["open"][start:stop] = np.where(
+            opened, source["open"][lo:hi][np.where(opened, first, 0)], np.nan
+        )
+        bars["high"][start:stop] = np.fmax.reduceat(source["high"][lo:hi], at)
+        bars["low"][start:stop] = np.fmin.reduceat(source["low"][lo:hi], at)
+        bars["close"][start:stop] = np.where(
+            closed, source["close"][lo:hi][np.where(closed, last, 0)], np.nan
+        )
+        volume = np.where(covered, source["volume"][lo:hi], 0)
+        bars["volume"][start:stop] = np.where(
+            closed, np.add.reduceat(volume, at), np.nan
+        )
+
+    def source(self, n):
+        # the coarsest level that divides n, so its bars never straddle one
+        # of ours; the minutes themselves are the bottom level
+        m = max(
+            [level for level in self.levels if level < n and n % level == 0],
+            default=1,
+        )
+        if m == 1:
+            return 1, {
+                "open": self.open,
+                "high": self.high,
+                "low": self.low,
+                "close": self.close,
+                "volume": self.volume,
+            }
+
+        return m, self.refresh(m)
+
+    def refresh(self, n):
+        if n not in self.bars:
+            size = -(-self.session_minutes // n)
+            self.bars[n] = {
+                col: np.full(size, np.nan)
+                for col in ["open", "high", "low", "close", "volume"]
+            }
+            self.dirty[n] = 0
+
+        m, source = self.source(n)
+
+        timer = metrics.start()
+        bars = self.bars[n]
+        start, stop = self.dirty[n], self.last // n + 1
+        self.aggregate(source, n // m, start, stop, bars)
+        for key, indicator in self.indicators.items():
+            if key[0] == n:
+                indicator.update(bars, start, stop)
+        self.dirty[n] = max(stop, 0)
+        metrics.stop("bar_aggregation_seconds", timer)
+
+        return bars
+
+    def get_bars(self, n):
+        with self.lock:
+            bars = self.refresh(n)
+            return {col: values.copy() for col, values in bars.items()}
+
+    def indicator(self, n, name, window=None, version=None):
+        with self.lock:
+            if version is not None and version != self.version:
+                return None
+
+            bars = self.refresh(n)
+            key = (n, name, window)
+            if key not in self.indicators:
+                indicator = self.indicator_types[name](
+                    len(bars["close"]), window
+                )
+                indicator.update(bars, 0, self.dirty[n])
+                self.indicators[key] = indicator
+
+            return {
+                col: values.copy()
+                for col, values in self.indicators[key].values.items()
+            }
+
+    def to_frame(self, n):
+        calendar = session_calendar.get(n, self.day())
+        with self.lock:
+            df_ohlc = pd.DataFrame(self.get_bars(n))
+            version = self.version
+
+        # a partial last bin is only listed once trades reach it
+        if self.session_minutes % n and np.isnan(df_ohlc["close"].iloc[-1]):
+            df_ohlc = df_ohlc.iloc[:-1]
+
+        df_ohlc.insert(0, "at", calendar.time_index[: len(df_ohlc)])
+        df_ohlc.attrs.update(
+            symbol_id=self.symbol_id, interval=n, version=version
+        )
+
+        return df_ohlc
+
+
+def frame_indicator(bar, df, name, window=None):
+    # a frame of to_frame, or a slice of one, reads the streaming values of
+    # its bar builder at the bars it holds; any other frame falls back to
+    # pandas
+    n = df.attrs.get("interval")
+    values = None
+    if bar is not None and n:
+        with bar.lock:
+            if df.attrs.get("version") == bar.version:
+                close = bar.refresh(n)["close"]
+                index = df.index.to_numpy()
+                if (
+                    index.dtype.kind in "iu"
+                    and (index >= 0).all()
+                    and (index < len(close)).all()
+                    and np.array_equal(
+                        close[index],
+                        df["close"].to_numpy(dtype=float),
+                        equal_nan=True,
+                    )
+                ):
+                    values = bar.indicator(n, name, window)
+
+    if values is not None:
+        return {
+            col: pd.Series(value[index], index=df.index)
+            for col, value in values.items()
+        }
+
+    close = df["close"]
+    if name == "sma":
+        return {"sma": close.rolling(window).mean()}
+    elif name == "ema":
+        return {"ema": close.ewm(span=window, adjust=False).mean()}
+    elif name == "vwap":
+        return {
+            "vwap": (close * df["volume"]).cumsum() / df["volume"].cumsum()
+        }
+    elif name == "bollinger":
+        mean = close.rolling(window).mean()
+        std = close.rolling(window).std()
+        return {
+            "mid": mean,
+            "upper": mean + 2 * std,
+            "lower": mean - 2 * std,
+        }
+
+
+def volume_color(df, rise_color, down_color, color=None):
+    # colours already known for the leading bars are kept as they are
+    color = list(color or [])
+    start = len(color)
+
+    close = df["close"].to_numpy(dtype=float)
+    prev_close = np.concatenate([[np.nan], close[:-1]])[start:]
+    close = close[start:]
+    open_ = df["open"].to_numpy(dtype=float)[start:]
+
+    change = np.select(
+        [
+            close > open_,
+            close < open_,
+            close > prev_close,
+            close < prev_close,
+        ],
+        [1.0, -1.0, 1.0, -1.0],
+        default=np.nan,
+    )
+
+    # flat bars keep the colour of the bar before them
+    last = -1.0 if color and color[-1] == down_color else 1.0
+    change = pd.Series(change).ffill().fillna(last).to_numpy()
+
+    return color + np.where(change > 0, rise_color, down_color).tolist()
+
+
+class order_book:
+    level_dtype = np.dtype([("price", float), ("unit", float)])
+
+    def __init__(self, depth=50):
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.reset()
+
+    @staticmethod
+    def levels(levels):
+        # bestBids or bestAsks of a quote as one (price, unit) array
+        return np.array(
+            [(level["price"], level["unit"]) for level in levels],
+            dtype=order_book.level_dtype,
+        )
+
+    def reset(self, symbol_id=None):
+        self.symbol_id = symbol_id
+        self.sequence = 0
+        self.applied = 0
+        self.price = np.empty(0)
+        self.bid_unit = np.empty(0)
+        self.ask_unit = np.empty(0)
+        self.seen = np.empty(0, dtype=int)
+        self.price_list = []
+        self.frame = None
+
+    def apply(self, bids, asks):
+        timer = metrics.start()
+
+        # bids and asks are arrays of order_book.levels
+        price = np.union1d(bids["price"], asks["price"])
+        bid_unit = np.full(len(price), np.nan)
+        ask_unit = np.full(len(price), np.nan)
+        bid_unit[np.searchsorted(price, bids["price"])] = bids["unit"]
+        ask_unit[np.searchsorted(price, asks["price"])] = asks["unit"]
+
+        # prices are kept ascending so each level is found by bisection
+        index = np.searchsorted(self.price, price)
+        found = np.zeros(len(price), dtype=bool)
+        if len(self.price):
+            found = self.price[np.minimum(index, len(self.price) - 1)] == price
+
+        if not found.all():
+            at = index[~found]
+            self.price = np.insert(self.price, at, price[~found])
+            self.bid_unit = np.insert(self.bid_unit, at, np.nan)
+            self.ask_unit = np.insert(self.ask_unit, at, np.nan)
+            self.seen = np.insert(self.seen, at, 0)
+            index = np.searchsorted(self.price, price)
+
+        self.sequence += 1
+        self.bid_unit[index] = bid_unit
+        self.ask_unit[index] = ask_unit
+        self.seen[index] = self.sequence
+        self.price_list = price[::-1].tolist()
+        self.frame = None
+
+        self.evict()
+        metrics.stop("order_book_update_seconds", timer)
+
+    def evict(self):
+        if self.depth is None or len(self.price) <= self.depth:
+            return
+
+        # drop the levels that have gone longest without being quoted
+        keep = np.sort(np.argsort(-self.seen, kind="stable")[: self.depth])
+        self.price = self.price[keep]
+        self.bid_unit = self.bid_unit[keep]
+        self.ask_unit = self.ask_unit[keep]
+        self.seen = self.seen[keep]
+
+    def to_frame(self):
+        # polls between two quotes get the frame that is already built
+        if self.frame is None:
+            self.frame = pd.DataFrame(
+                {
+                    "bid_unit": self.bid_unit[::-1],
+                    "price": self.price[::-1],
+                    "ask_unit": self.ask_unit[::-1],
+                }
+            )
+
+        return self.frame
+
+
+def alert_message(symbol_id, rule_type, side, target):
+    if rule_type == "price":
+        text = (
+            ("價格已經高過" if side > 0 else "價格已經跌破")
+            + str(target)
+            + "元"
+        )
+    else:
+        text = (
+            ("漲幅已經高過" if side > 0 else "跌幅已經低過")
+            + str(target * 100)
+            + "%"
+        )
+
+    return (
+        "快訊！"
+        + symbol_id
+        + text
+        + "\n"
+        + "https://www.fugle.tw/trade?symbol_id="
+        + symbol_id
+        + "&openExternalBrowser=1"
+    )
+
+
+def alert_value(change, price, reference):
+    # a change rule is compared with the change of the price from its
+    # reference, a price rule with the price itself
+    return np.where(change, (price - reference) / reference, price)
+
+
+def alert_bounds(change, rise, drop, reference, hysteresis=0):
+    # the lower bound of every rule in the units of its rule, and the prices
+    # at which a rule that alerted is armed again, once the price is back
+    # inside its band by the hysteresis margin
+    lower = np.where(change, -drop, drop)
+    rise_rearm = np.where(change, reference * (1 + rise), rise) * (
+        1 - hysteresis
+    )
+    drop_rearm = np.where(change, reference * (1 - drop), drop) * (
+        1 + hysteresis
+    )
+
+    return lower, rise_rearm, drop_rearm
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import datetime
+import math
+import random
+import time
+import tracemalloc
+
+import fugle_realtime_restful_api
+from fugle_realtime_restful_api import *
+
+
+def chart_raw(minutes=270, seed=0):
+
+    random.seed(seed)
+    now = datetime.datetime.utcnow()
+    start = datetime.datetime(now.year, now.month, now.day, 1, 0)
+
+    chart = {}
+    price = 25.0
+    for i in range(1, minutes + 1):
+        close = round(price + random.choice([-0.05, 0, 0.05]), 2)
+        at = start + datetime.timedelta(minutes=i)
+        chart[at.strftime("%Y-%m-%dT%H:%M:%S.000Z")] = {
+            "open": price,
+            "high": max(price, close) + 0.05,
+            "low": min(price, close) - 0.05,
+            "close": close,
+            "unit": random.randint(1, 100),
+            "volume": random.randint(1000, 100000),
+        }
+        price = close
+
+    return chart
+
+
+def quote_raw(price=25.0):
+
+    return {
+        "trade": {"price": price, "unit": 1, "volume": 1000},
+        "order": {
+            "bestBids": [
+                {"price": round(price - 0.05 * i, 2), "unit": i}
+                for i in range(5)
+            ],
+            "bestAsks": [
+                {"price": round(price + 0.05 * (i + 1), 2), "unit": i}
+                for i in range(5)
+            ],
+        },
+    }
+
+
+class offline_intraday:
+    # answers chart and quote requests with synthetic data, so the real
+    # get_chart_data and get_new_quote_data are timed without the network
+    def __init__(self, minutes=270):
+        self.raw = chart_raw(minutes)
+        self.message = quote_raw()
+
+    def chart(self, symbolId, apiToken, output="raw"):
+        return self.raw
+
+    def quote(self, symbolId, apiToken, output="raw"):
+        return self.message
+
+
+class recorded_dispatcher:
+    # collects the alerts instead of posting them to LINE Notify
+    def __init__(self):
+        self.messages = []
+
+    def send(self, msg):
+        self.messages.append(msg)
+
+
+def cached_line_notify(symbol_ids):
+
+    # quotes never expire, so the strategies are timed without the network
+    cache = intraday_cache("benchmark", quote_ttl=math.inf)
+    today = datetime.date.today()
+    for i, symbol_id in enumerate(symbol_ids):
+        cache.quotes[symbol_id] = (0, quote_raw(20 + i % 10))
+        cache.metas[symbol_id] = (today, {"priceReference": 25.0})
+
+    return line_notify("benchmark", "benchmark", cache, recorded_dispatcher())
+
+
+def measure(function, number=20):
+
+    # latency is the best of a few batches, allocations the peak of one call
+    function()
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def report(name, function, number=20):
+
+    seconds, peak = measure(function, number)
+    print(f"{name:<36} {1e6 * seconds:12.1f} us {peak / 1024:10.1f} KiB")
+
+
+def bench_hot_paths(minutes=(30, 135, 270), symbols=(1, 10, 50)):
+
+    fugle_realtime_restful_api.intraday = offline_intraday(270)
+    chart = chart_api("benchmark")
+    quote = quote_api("benchmark")
+
+    print(f"{'hot path':<36} {'per call':>15} {'peak alloc':>14}")
+
+    for n in (1, 5, 15, 30):
+        report(
+            f"get_chart_data n={n}", lambda: chart.get_chart_data(n, "2884")
+        )
+
+    df_ohlc = chart.get_chart_data(5, "2884")
+    report(
+        "plot_volume_bar n=5",
+        lambda: chart.plot_volume_bar(df_ohlc, "red", "green"),
+    )
+    report("plot_MA n=5 window=5", lambda: chart.plot_MA(df_ohlc, 5, "b", 2))
+
+    report("get_new_quote_data", lambda: quote.get_new_quote_data("2884"))
+    df_quote, price_list = quote.get_new_quote_data("2884")
+    report(
+        "plot_order_book",
+        lambda: quote.plot_order_book(df_quote, price_list, "2884"),
+    )
+
+    for count in minutes:
+        raw = chart_raw(count)
+        report(
+            f"resample_chart bars={count}",
+            lambda: chart_api.resample_chart("2884", raw, [1, 5, 15, 30]),
+            5,
+        )
+
+    for count in symbols:
+        symbol_ids = [str(2000 + i) for i in range(count)]
+        line = cached_line_notify(symbol_ids)
+        report(
+            f"target_price_strategy symbols={count}",
+            lambda: [
+                line.target_price_strategy(s, 28, 22) for s in symbol_ids
+            ],
+        )
+        report(
+            f"target_change_strategy symbols={count}",
+            lambda: [
+                line.target_change_strategy(s, 0.05, 0.05) for s in symbol_ids
+            ],
+        )
+
+        rules = [(s, "price", 28, 22) for s in symbol_ids] + [
+            (s, "change", 0.05, 0.05) for s in symbol_ids
+        ]
+        engine = alert_engine(line, rules)
+        prices = {s: 20 + i % 10 for i, s in enumerate(symbol_ids)}
+        references = {s: 25.0 for s in symbol_ids}
+        report(
+            f"alert_engine.evaluate symbols={count}",
+            lambda: engine.evaluate(prices, references),
+        )
+
+
+if __name__ == "__main__":
+    bench_hot_paths()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import random
+
+import numpy as np
+import pandas as pd
+
+from fugle_realtime_restful_api import *
+from benchmark import chart_raw
+
+
+def gapped_chart(minutes=270, gaps=0.2, seed=0):
+
+    # a chart with minutes that had no trades, as the API leaves them out
+    chart = chart_raw(minutes, seed)
+    random.seed(seed)
+    return {
+        at: bar
+        for i, (at, bar) in enumerate(chart.items())
+        if i == 0 or random.random() > gaps
+    }
+
+
+def reference_minutes(chart, session_minutes=270):
+
+    # the minutes of the session straight from the chart with pandas: no
+    # trade keeps NaN prices, the close is carried forward and the volume
+    # is 0 up to the last trade, and nothing is known after it
+    df = pd.DataFrame.from_dict(chart, orient="index")
+    at = pd.to_datetime(df.index).tz_localize(None)
+    df.index = (at.hour * 60 + at.minute + 480 - 541).to_numpy()
+    df = df[["open", "high", "low", "close", "volume"]].astype(float)
+
+    minutes = df.reindex(range(session_minutes))
+    last = df.index.max()
+    minutes.loc[:last, "close"] = minutes.loc[:last, "close"].ffill()
+    traded_before = minutes["close"].notna()
+    minutes.loc[traded_before, "volume"] = minutes.loc[
+        traded_before, "volume"
+    ].fillna(0)
+    minutes.index = pd.date_range("09:01", periods=session_minutes, freq="T")
+
+    return minutes
+
+
+def reference_bars(minutes, n):
+
+    # every bin of n minutes from the session open, by pandas resample
+    resampled = minutes.resample(f"{n}T", origin="start")
+    bars = pd.DataFrame(
+        {
+            "open": resampled["open"].first(),
+            "high": resampled["high"].max(),
+            "low": resampled["low"].min(),
+            "close": resampled["close"].last(),
+            "volume": resampled["volume"].sum(min_count=1),
+        }
+    )
+
+    return {col: bars[col].to_numpy() for col in bars}
+
+
+def compare(bar, minutes, intervals):
+
+    mismatches = []
+    for n in intervals:
+        expected = reference_bars(minutes, n)
+        got = bar.get_bars(n)
+        for col in ["open", "high", "low", "close", "volume"]:
+            if not np.allclose(got[col], expected[col], equal_nan=True):
+                mismatches.append((n, col))
+
+    return mismatches
+
+
+def check_full_day(intervals=range(1, 301)):
+
+    # a whole day with gaps, read at every interval
+    chart = gapped_chart()
+    bar = bar_builder()
+    bar.update("2884", chart)
+    mismatches = compare(bar, reference_minutes(chart), intervals)
+
+    print(f"full day     {len(intervals)} intervals, {len(mismatches)} off")
+    assert not mismatches, mismatches[:10]
+
+
+def check_incremental(intervals=(1, 2, 5, 7, 10, 15, 30, 45, 60, 270)):
+
+    # minutes arrive one by one, and the newest one is revised as it
+    # trades, so every level only recomputes the bins it touches
+    chart = gapped_chart(seed=1)
+    keys = list(chart)
+    bar = bar_builder()
+    mismatches = []
+    for stop in range(1, len(keys) + 1):
+        part = {at: chart[at] for at in keys[:stop]}
+        newest = dict(part[keys[stop - 1]])
+        newest["close"] = round(newest["close"] - 0.05, 2)
+        newest["low"] = min(newest["low"], newest["close"])
+        newest["volume"] //= 2
+        part[keys[stop - 1]] = newest
+        bar.update("2884", part)
+
+        part[keys[stop - 1]] = chart[keys[stop - 1]]
+        bar.update("2884", part)
+        if stop % 7 == 0 or stop == len(keys):
+            mismatches += compare(bar, reference_minutes(part), intervals)
+
+    print(f"incremental  {len(keys)} minutes, {len(mismatches)} off")
+    assert not mismatches, mismatches[:10]
+
+
+def check_to_frame(intervals=(1, 5, 7, 30, 60, 270)):
+
+    # to_frame lists the bins of the session and drops an empty partial one
+    chart = gapped_chart(minutes=100, seed=2)
+    bar = bar_builder()
+    bar.update("2884", chart)
+    minutes = reference_minutes(chart)
+    for n in intervals:
+        df_ohlc = bar.to_frame(n)
+        expected = pd.DataFrame(reference_bars(minutes, n))
+        if 270 % n and np.isnan(expected["close"].iloc[-1]):
+            expected = expected.iloc[:-1]
+        pd.testing.assert_frame_equal(
+            df_ohlc.drop(columns="at").reset_index(drop=True),
+            expected.reset_index(drop=True),
+        )
+
+    print(f"to_frame     {len(intervals)} intervals match")
+
+
+if __name__ == "__main__":
+    check_full_day()
+    check_incremental()
+    check_to_frame()
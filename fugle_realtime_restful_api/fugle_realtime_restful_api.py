@@ -12,7 +12,15 @@ from fugle_realtime import intraday
 import pandas as pd
 import numpy as np
 import datetime
+import itertools
+import os
+import sys
 import requests
+import threading
+import time
+import queue
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 
 import dash
 import dash_core_components as dcc
@@ -21,57 +29,122 @@ import dash_table
 from dash.dependencies import Input, Output
 import dash_daq as daq
 
-
-# In[32]:
+# the bar core is shared with the websocket demo, one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fugle_realtime_core import (alert_bounds, alert_message, alert_value, bar_builder, bar_store, bollinger, ema,
+                                 frame_indicator, metrics, order_book, session_calendar, sma, volume_color, vwap)
 
 
 class chart_api():
     
-    def __init__(self, api_token):
+    def __init__(self, api_token, max_workers=8, store=None, max_age=0, timeout=10):
         
         self.api_token = api_token
-        
-    def get_chart_data(self, n, symbol_id):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.store = store
+        self.max_age = max_age
+        self.bars = {}
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+
+    def get_bar(self, symbol_id):
+
+        # every symbol keeps its own builder, so callbacks for different
+        # symbols never read each other's minutes or reset each other
+        with self.lock:
+            if symbol_id not in self.bars:
+                self.bars[symbol_id] = bar_builder(self.store)
+            return self.bars[symbol_id]
+
+    def get_chart_data(self, n, symbol_id, date=None):
+
+        today = datetime.date.today().isoformat()
+        if date is not None and date != today:
+            # earlier days are only read from the store
+            bar = bar_builder()
+            if self.store is not None and date in self.store.dates(symbol_id):
+                bar.store = self.store
+            bar.reset(symbol_id, date)
+            return bar.to_frame(n)
+
+        if self.store is not None:
+            # a worker that finds today written within max_age seconds
+            # serves it as it is instead of asking the API again
+            mtime = self.store.mtime(symbol_id, today)
+            if mtime is not None and time.time() - mtime < self.max_age:
+                bar = self.get_bar(symbol_id)
+                bar.load(symbol_id, today)
+                return bar.to_frame(n)
+
+        timer = metrics.start()
+        chart = intraday.chart(symbolId=symbol_id, apiToken=self.api_token, output='raw')
+        metrics.stop('receive_seconds{endpoint="chart"}', timer)
+        bar = self.get_bar(symbol_id)
+        try:
+            bar.update(symbol_id, chart)
+        except ValueError as error:
+            # an error payload leaves the minutes already built and stored
+            metrics.error('get_chart_data', (symbol_id, error))
 
-        now = datetime.datetime.now()
-        today = now.strftime('%Y-%m-%d')
-        close_time = datetime.datetime(now.year,now.month,now.day, 13, 30)
+        return bar.to_frame(n)
 
-        time_index = pd.date_range(start=f'{today} 09:00:00',
-                                   end=f'{today} 13:30:00', freq=f'{n}T', closed='right')
+    def fetch_chart(self, symbol_id):
 
-        df_time = pd.DataFrame(time_index, columns=['at'])
+        # a symbol that fails or hangs is reported and left out, so the rest
+        # of the batch still comes back
+        timer = metrics.start()
+        try:
+            r = self.session.get('https://api.fugle.tw/realtime/v0/intraday/chart',
+                                 params={'apiToken': self.api_token, 'symbolId': symbol_id},
+                                 timeout=self.timeout)
+            r.raise_for_status()
+            chart = r.json()['data']['chart']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as error:
+            metrics.error('fetch_chart', (symbol_id, error))
+            return None
+        finally:
+            metrics.stop('receive_seconds{endpoint="chart"}', timer)
 
-        df = intraday.chart(
-            symbolId=symbol_id, apiToken=self.api_token, output='dataframe')
+        return chart
 
+    @staticmethod
+    def resample_chart(symbol_id, chart, intervals):
 
-        df['at'] = df['at'].apply(lambda x: x.astimezone(None) + datetime.timedelta(hours=8))
-        df = df.set_index('at')
+        if chart is None:
+            return None
 
-        df = df.asfreq('1T')
-        df['close'] = df['close'].fillna(method='ffill')
-        df['volume'] = df['volume'].fillna(0)
-        df = df.fillna(axis=1, method='ffill')
+        bar = bar_builder()
+        bar.update(symbol_id, chart)
 
-        df = df[['open', 'high', 'low', 'close', 'volume']]
+        frames = {}
+        for n in intervals:
+            df_ohlc = bar.to_frame(n)
+            # the builder is thrown away, so the frame must not point at one
+            df_ohlc.attrs.clear()
+            frames[n] = df_ohlc
 
-        df_ohlc = df.resample(f'{n}T', kind='period').agg({'open': 'first',
-                                                           'high': 'max',
-                                                           'low': 'min',
-                                                           'close': 'last',
-                                                           'volume': 'sum'
-                                                          })
+        return frames
 
-        df_ohlc.index = df_ohlc.index + datetime.timedelta(minutes=n-1)
+    def get_batch_chart_data(self, symbol_ids, intervals, processes=None):
 
-        df_ohlc = df_ohlc.to_timestamp().reset_index()
-        
-        df_ohlc = pd.merge(df_time, df_ohlc, on='at', how='outer')
-        df_ohlc['at'] = df_ohlc['at'].apply(lambda x: x if x <= close_time else close_time)
-        
-        return df_ohlc
-    
+        symbol_ids = list(symbol_ids)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            charts = list(executor.map(self.fetch_chart, symbol_ids))
+
+        args = (symbol_ids, charts, itertools.repeat(intervals))
+        if processes:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                frames = list(executor.map(self.resample_chart, *args,
+                                           chunksize=max(1, len(symbol_ids) // (4 * processes))))
+        else:
+            frames = list(map(self.resample_chart, *args))
+
+        return dict(zip(symbol_ids, frames))
     
     def plot_ohlc(self, df, rise_color, down_color):
 
@@ -87,41 +160,47 @@ class chart_api():
             'decreasing':{'line':{'color':down_color}}
         }
       
-    def plot_MA(self, df, n, line_color, line_width):
+    def get_indicator(self, df, name, window=None):
 
-        df[f'{n}MA'] = df['close'].rolling(n).mean()
+        return frame_indicator(self.bars.get(df.attrs.get('symbol_id')), df, name, window)
+
+    def plot_line(self, df, y, name, line_color, line_width):
 
         return {
             'type':'scatter',
             'x':df['at'],
-            'y':df[f'{n}MA'],
+            'y':y,
             'mode':'lines',
             'line':{'color':line_color, 'width':line_width},
-            'name':f'{n}MA'
+            'name':name
         }
 
-    def plot_volume_bar(self, df, rise_color, down_color):
+    def plot_MA(self, df, n, line_color, line_width):
+
+        return self.plot_line(df, self.get_indicator(df, 'sma', n)['sma'], f'{n}MA', line_color, line_width)
 
-        color = []
-        for i in range(len(df)):
-            try:
-                if df['close'][i] > df['open'][i]:
-                    color.append(rise_color)
+    def plot_EMA(self, df, n, line_color, line_width):
 
-                elif df['close'][i] < df['open'][i]:
-                    color.append(down_color)
+        return self.plot_line(df, self.get_indicator(df, 'ema', n)['ema'], f'{n}EMA', line_color, line_width)
 
-                elif df['close'][i] == df['open'][i]:
+    def plot_VWAP(self, df, line_color, line_width):
 
-                    if df['close'][i] > df['close'][i-1]:
-                        color.append(rise_color)
-                    elif df['close'][i] < df['close'][i-1]:
-                        color.append(down_color)
-                    elif df['close'][i] == df['close'][i-1]:
-                        color.append(color[-1])
+        return self.plot_line(df, self.get_indicator(df, 'vwap')['vwap'], 'VWAP', line_color, line_width)
 
-            except (IndexError, KeyError):
-                color.append(rise_color)
+    def plot_bollinger(self, df, n, line_color, line_width):
+
+        bands = self.get_indicator(df, 'bollinger', n)
+
+        return [self.plot_line(df, bands['upper'], f'{n}BB upper', line_color, line_width),
+                self.plot_line(df, bands['lower'], f'{n}BB lower', line_color, line_width)]
+
+    def volume_color(self, df, rise_color, down_color, color=None):
+
+        return volume_color(df, rise_color, down_color, color)
+
+    def plot_volume_bar(self, df, rise_color, down_color, color=None):
+
+        color = self.volume_color(df, rise_color, down_color, color)
 
         return {
             'type':'bar',
@@ -142,145 +221,451 @@ class quote_api():
     def __init__(self, api_token):
 
         self.api_token = api_token
+        self.book = order_book()
+        self.rows = {}
 
     def get_first_quote_data(self, symbol_id):
 
-        message = intraday.quote(apiToken= self.api_token, symbolId=symbol_id, output='raw')
-
-        ask = message['order']['bestAsks']
-        ask.reverse()
-        
-        df_ask = pd.DataFrame(ask, columns=['price', 'unit']).rename(columns={'unit': 'ask_unit'})
-
-        bid = message['order']['bestBids']
-        bid.reverse()
-        
-        df_bid = pd.DataFrame(bid, columns=['unit', 'price']).rename(
-            columns={'unit': 'bid_unit'})
-
-        df_quote = pd.merge(df_ask, df_bid, on='price', how='outer')
-        df_quote = df_quote[['bid_unit', 'price', 'ask_unit']]
+        self.book.reset(symbol_id)
 
-        price_list = list(df_quote['price'])
+        return self.get_new_quote_data(symbol_id)
 
-        return df_quote, price_list
+    def get_new_quote_data(self, symbol_id, df_quote=None):
 
-    def get_new_quote_data(self,symbol_id, df_quote):
-
-        df_quote2, price_list = self.get_first_quote_data(symbol_id)
-
-        df_quote = pd.concat([df_quote, df_quote2], axis=0).drop_duplicates(subset='price', keep='last')
-        df_quote = df_quote.sort_values('price', ascending=False).reset_index(drop=True)
+        timer = metrics.start()
+        message = intraday.quote(apiToken= self.api_token, symbolId=symbol_id, output='raw')
+        metrics.stop('receive_seconds{endpoint="quote"}', timer)
+        metrics.lag('message_lag_seconds', message)
+        self.book.apply(order_book.levels(message['order']['bestBids']), order_book.levels(message['order']['bestAsks']))
 
-        return df_quote, price_list
+        return self.book.to_frame(), self.book.price_list
 
     def update_quote_data(self, input_symbol):
 
-        global df_quote, symbol
+        if input_symbol == self.book.symbol_id:
+            df_quote, price_list = self.get_new_quote_data(input_symbol)
+        else:
+            df_quote, price_list = self.get_first_quote_data(input_symbol)
 
-        try:
-            if input_symbol == symbol:
-                df_quote, price_list = self.get_new_quote_data(symbol, df_quote)
-            else:
-                symbol = input_symbol
-                df_quote, price_list = self.get_first_quote_data(symbol)
-        except:
-            symbol = input_symbol
-            df_quote, price_list = self.get_first_quote_data(symbol)
+        return df_quote, price_list, input_symbol
 
-        return df_quote, price_list, symbol
+    def order_book_row(self, symbol_id, columns, values, active):
 
-    def plot_order_book(self, dataframe, price_list, symbol_id):
+        key = (symbol_id, columns, tuple(None if value != value else value for value in values), active)
+        row = self.rows.get(key)
 
-        rows = []
-        for i in range(len(dataframe)):
+        if row is None:
             row = []
-            for col in dataframe.columns:
-                value = dataframe.iloc[i][col]
+            for col, value in zip(columns, values):
 
                 if col == 'price':
+                    link = {'href': 'https://www.fugle.tw/ai/'+symbol_id, 'children': value}
+                    if not active:
+                        link['style'] = {'color': 'gray'}
 
-                    if value not in price_list:
-
-                        cell = html.Td(html.A(href='https://www.fugle.tw/ai/'+symbol_id,
-                                              children=value,
-                                              style={'color': 'gray'}),
-                                       style={'font-size': 16, 'text-align': 'center'})
-
-                    elif value in price_list:
-
-                        cell = html.Td(html.A(href='https://www.fugle.tw/ai/'+symbol_id,
-                                              children=value),
-                                       style={'font-size': 16, 'text-align': 'center'})
+                    cell = html.Td(html.A(**link),
+                                   style={'font-size': 16, 'text-align': 'center'})
 
                 else:
                     cell = html.Td(children=value,
                                    style={'font-size': 16, 'text-align': 'center'})
 
                 row.append(cell)
-            rows.append(html.Tr(row))
+
+            if len(self.rows) >= 1000:
+                self.rows.clear()
+            row = self.rows[key] = html.Tr(row)
+
+        return row
+
+    def plot_order_book(self, dataframe, price_list, symbol_id):
+
+        columns = tuple(dataframe.columns)
+        price_list = set(price_list)
+        price = columns.index('price')
+
+        rows = [self.order_book_row(symbol_id, columns, values, values[price] in price_list)
+                for values in dataframe.itertuples(index=False, name=None)]
 
         return html.Table(
             [html.Tr([html.Th(col) for col in dataframe.columns],
                      style={'font-size': 16, 'text-align': 'center', 'table-align': 'center'})] + rows
         )
 
+    def plot_order_book_table(self, dataframe, price_list, symbol_id):
+
+        stale = np.flatnonzero(~dataframe['price'].isin(price_list))
+
+        return dash_table.DataTable(
+            id='order_book_table',
+            columns=[{'name': col, 'id': col} for col in dataframe.columns],
+            data=dataframe.to_dict('records'),
+            style_cell={'font-size': 16, 'text-align': 'center'},
+            style_data_conditional=[{'if': {'row_index': int(i), 'column_id': 'price'}, 'color': 'gray'}
+                                    for i in stale]
+        )
+
 
 # In[34]:
 
 
+class intraday_cache():
+
+    instances = {}
+    instances_lock = threading.Lock()
+
+    def __init__(self, api_token, quote_ttl=1):
+
+        self.api_token = api_token
+        self.quote_ttl = quote_ttl
+        self.quotes = {}
+        self.metas = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls, api_token):
+
+        with cls.instances_lock:
+            if api_token not in cls.instances:
+                cls.instances[api_token] = cls(api_token)
+            return cls.instances[api_token]
+
+    def fetch(self, key, request):
+
+        # callers asking for the same key while a request is in flight wait
+        # for its result instead of sending their own
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            timer = metrics.start()
+            result = request()
+            if timer is not None:
+                metrics.stop('receive_seconds{endpoint="%s"}' % key[0], timer)
+            future.set_result(result)
+            return result
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    def quote(self, symbol_id):
+
+        cached = self.quotes.get(symbol_id)
+        if cached is not None and time.monotonic() - cached[0] < self.quote_ttl:
+            return cached[1]
+
+        message = self.fetch(('quote', symbol_id),
+                             lambda: intraday.quote(apiToken=self.api_token, symbolId=symbol_id, output='raw'))
+        metrics.lag('message_lag_seconds', message)
+        self.quotes[symbol_id] = (time.monotonic(), message)
+
+        return message
+
+    def meta(self, symbol_id):
+
+        today = datetime.date.today()
+
+        cached = self.metas.get(symbol_id)
+        if cached is not None and cached[0] == today:
+            return cached[1]
+
+        message = self.fetch(('meta', symbol_id),
+                             lambda: intraday.meta(symbolId=symbol_id, apiToken=self.api_token, output='raw'))
+        if 'priceReference' in message:
+            self.metas[symbol_id] = (today, message)
+
+        return message
+
+
+class notify_dispatcher():
+
+    instances = {}
+    instances_lock = threading.Lock()
+
+    def __init__(self, line_token, url='https://notify-api.line.me/api/notify',
+                 rate_limit=1000, period=3600, retries=3, backoff=1, batch=1, workers=1):
+
+        self.line_token = line_token
+        self.url = url
+        self.rate_limit = rate_limit
+        self.period = period
+        self.retries = retries
+        self.backoff = backoff
+        self.batch = batch
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": "Bearer " + self.line_token,
+            "Content-Type" : "application/x-www-form-urlencoded"
+        })
+
+        self.sent = collections.deque()
+        self.reset_at = 0
+        self.lock = threading.Lock()
+
+        self.queue = queue.Queue()
+        self.threads = [threading.Thread(target=self.worker, name='notify_dispatcher', daemon=True)
+                        for _ in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    @classmethod
+    def get(cls, line_token):
+
+        with cls.instances_lock:
+            if line_token not in cls.instances:
+                cls.instances[line_token] = cls(line_token)
+            return cls.instances[line_token]
+
+    def send(self, msg):
+
+        self.queue.put(msg)
+
+    def join(self):
+
+        self.queue.join()
+
+    def close(self):
+
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+    def worker(self):
+
+        while True:
+            msg = self.queue.get()
+            if msg is None:
+                self.queue.task_done()
+                break
+
+            # alerts that queued up while the last one was posted go out
+            # together, within the 1000 characters LINE Notify accepts
+            messages = [msg]
+            while len(messages) < self.batch:
+                try:
+                    msg = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if msg is None or len('\n\n'.join(messages + [msg])) > 1000:
+                    self.queue.put(msg)
+                    self.queue.task_done()
+                    break
+                messages.append(msg)
+
+            try:
+                self.post('\n\n'.join(messages))
+            except Exception as error:
+                metrics.error('notify_worker', error)
+            finally:
+                for _ in messages:
+                    self.queue.task_done()
+
+    def wait_for_slot(self):
+
+        with self.lock:
+            now = time.monotonic()
+            while self.sent and now - self.sent[0] >= self.period:
+                self.sent.popleft()
+
+            delay = 0
+            if len(self.sent) >= self.rate_limit:
+                delay = self.period - (now - self.sent[0])
+            delay = max(delay, self.reset_at - time.time())
+
+            self.sent.append(now + max(delay, 0))
+
+        if delay > 0:
+            metrics.observe('notify_throttled_seconds', delay)
+            time.sleep(delay)
+
+    def post(self, msg):
+
+        for attempt in range(self.retries + 1):
+            self.wait_for_slot()
+
+            try:
+                timer = metrics.start()
+                r = self.session.post(self.url, params={'message': msg})
+                metrics.stop('notify_send_seconds', timer)
+            except requests.RequestException as error:
+                metrics.error('notify', error)
+            else:
+                if metrics.enabled:
+                    metrics.count('notify_sent_total{status="%d"}' % r.status_code)
+                if r.headers.get('X-RateLimit-Remaining') == '0':
+                    self.reset_at = float(r.headers.get('X-RateLimit-Reset', 0))
+                if r.status_code != 429 and r.status_code < 500:
+                    return r.status_code
+
+            if attempt < self.retries:
+                metrics.count('notify_retries_total')
+                time.sleep(self.backoff * 2 ** attempt)
+
+        return None
+
+
 class line_notify():
     
-    def __init__(self, api_token, line_token):
+    def __init__(self, api_token, line_token, cache=None, dispatcher=None):
         
         self.api_token = api_token
         self.line_token = line_token
+        self.cache = cache or intraday_cache.get(api_token)
+        self.dispatcher = dispatcher or notify_dispatcher.get(line_token)
         
     def lineNotifyMessage(self, msg):
+
+        return self.dispatcher.post(msg)
+
+    def notify(self, msg):
+
+        self.dispatcher.send(msg)
     
-        headers = {
-           "Authorization": "Bearer " + self.line_token, 
-           "Content-Type" : "application/x-www-form-urlencoded"
-       }
-
-        payload = {'message': msg}
-        r = requests.post("https://notify-api.line.me/api/notify", headers = headers, params = payload)
-        return r.status_code
-    
+    def alert_message(self, symbol_id, rule_type, side, target):
+
+        return alert_message(symbol_id, rule_type, side, target)
+
     def target_price_strategy(self, symbol_id, rise_target_price, drop_target_price):
 
-        message = intraday.quote(apiToken= self.api_token, symbolId=symbol_id, output='raw')
+        message = self.cache.quote(symbol_id)
         current_price = message['trade']['price']
 
         if current_price > rise_target_price:
-            self.lineNotifyMessage('快訊！' + symbol_id + '價格已經高過' + str(rise_target_price) + '元\n'+
-                                   'https://www.fugle.tw/trade?symbol_id=' + symbol_id + '&openExternalBrowser=1')
+            self.notify(self.alert_message(symbol_id, 'price', 1, rise_target_price))
 
         elif current_price < drop_target_price:
-            self.lineNotifyMessage('快訊！' + symbol_id + '價格已經跌破' + str(drop_target_price) + '元\n'+
-                                   'https://www.fugle.tw/trade?symbol_id=' + symbol_id + '&openExternalBrowser=1')
+            self.notify(self.alert_message(symbol_id, 'price', -1, drop_target_price))
 
         else:
             pass
         
     def target_change_strategy(self, symbol_id, rise_target_change, drop_target_change):
 
-        message = intraday.quote(apiToken=self.api_token, symbolId=symbol_id, output='raw')
+        message = self.cache.quote(symbol_id)
         current_price = message['trade']['price']
 
-        symbol_info = intraday.meta(symbolId= symbol_id, apiToken=self.api_token, output='raw')
+        symbol_info = self.cache.meta(symbol_id)
         adjust_open = symbol_info['priceReference']
 
         if (current_price - adjust_open) / adjust_open > rise_target_change:
-            self.lineNotifyMessage('快訊！' + symbol_id + '漲幅已經高過' + str(rise_target_change*100) + '%\n'+
-                                   'https://www.fugle.tw/trade?symbol_id=' + symbol_id + '&openExternalBrowser=1')
+            self.notify(self.alert_message(symbol_id, 'change', 1, rise_target_change))
 
         elif (current_price - adjust_open) / adjust_open < -drop_target_change:
-            self.lineNotifyMessage('快訊！' + symbol_id + '跌幅已經低過' + str(drop_target_change*100) + '%\n'+
-                                   'https://www.fugle.tw/trade?symbol_id=' + symbol_id + '&openExternalBrowser=1')
+            self.notify(self.alert_message(symbol_id, 'change', -1, drop_target_change))
 
         else:
             pass
 
         return current_price, adjust_open
 
+
+class alert_engine():
+
+    def __init__(self, line, rules, hysteresis=0, max_workers=8):
+
+        self.line = line
+        self.hysteresis = hysteresis
+        self.max_workers = max_workers
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+
+        self.rules = pd.DataFrame(rules, columns=['symbol_id', 'type', 'rise', 'drop']).reset_index(drop=True)
+        self.rise = self.rules['rise'].to_numpy(dtype=float)
+        self.drop = self.rules['drop'].to_numpy(dtype=float)
+        self.change = (self.rules['type'] == 'change').to_numpy()
+
+        # 1 after a rise alert, -1 after a drop alert, 0 while armed
+        self.state = np.zeros(len(self.rules), dtype=int)
+
+    def get_price(self, symbol_id):
+
+        # a symbol whose quote fails, or has no trade yet before the open or
+        # while suspended, is NaN and never alerts, the rest of the cycle
+        # goes on
+        try:
+            return self.line.cache.quote(symbol_id)['trade']['price']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as error:
+            metrics.error('get_prices', (symbol_id, error))
+            return np.nan
+
+    def get_reference(self, symbol_id):
+
+        try:
+            return self.line.cache.meta(symbol_id)['priceReference']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as error:
+            metrics.error('get_references', (symbol_id, error))
+            return np.nan
+
+    def get_prices(self, symbols):
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(symbols, executor.map(self.get_price, symbols)))
+
+    def get_references(self, symbols):
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(symbols, executor.map(self.get_reference, symbols)))
+
+    def evaluate(self, prices, references):
+
+        symbol_id = self.rules['symbol_id']
+        price = symbol_id.map(prices).to_numpy(dtype=float)
+        reference = symbol_id.map(references).to_numpy(dtype=float)
+
+        value = alert_value(self.change, price, reference)
+        lower, rise_rearm, drop_rearm = alert_bounds(self.change, self.rise, self.drop, reference, self.hysteresis)
+
+        fire_rise = value > self.rise
+        fire_drop = (value < lower) & ~fire_rise
+
+        # a rule is re-armed only once the price is back inside its band by
+        # the hysteresis margin, so a price hovering on the threshold does
+        # not alert every cycle
+        rearm = (((self.state == 1) & (price <= rise_rearm)) |
+                 ((self.state == -1) & (price >= drop_rearm)))
+
+        rise_new = fire_rise & (self.state != 1)
+        drop_new = fire_drop & (self.state != -1)
+
+        self.state[rearm & ~fire_rise & ~fire_drop] = 0
+        self.state[rise_new] = 1
+        self.state[drop_new] = -1
+
+        return np.flatnonzero(rise_new), np.flatnonzero(drop_new)
+
+    def run(self):
+
+        symbols = list(self.rules['symbol_id'].unique())
+        change_symbols = list(self.rules.loc[self.change, 'symbol_id'].unique())
+
+        prices = self.get_prices(symbols)
+        references = self.get_references(change_symbols)
+
+        rise_new, drop_new = self.evaluate(prices, references)
+
+        alerts = []
+        for side, column, index in ((1, 'rise', rise_new), (-1, 'drop', drop_new)):
+            for rule in self.rules.iloc[index].itertuples(index=False):
+                alerts.append(self.line.alert_message(rule.symbol_id, rule.type, side, getattr(rule, column)))
+
+        metrics.count('alerts_total', len(alerts))
+        for alert in alerts:
+            self.line.notify(alert)
+
+        return alerts
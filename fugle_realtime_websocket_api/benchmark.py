@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import datetime
+import json
+import random
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from fugle_realtime_websocket_api import *
+
+
+def chart_message(symbol_id="2884", minutes=270, seed=0):
+
+    random.seed(seed)
+    now = datetime.datetime.utcnow()
+    start = datetime.datetime(now.year, now.month, now.day, 1, 0)
+
+    chart = {}
+    price = 25.0
+    for i in range(1, minutes + 1):
+        close = round(price + random.choice([-0.05, 0, 0.05]), 2)
+        at = start + datetime.timedelta(minutes=i)
+        chart[at.strftime("%Y-%m-%dT%H:%M:%S.000Z")] = {
+            "open": price,
+            "high": max(price, close) + 0.05,
+            "low": min(price, close) - 0.05,
+            "close": close,
+            "unit": random.randint(1, 100),
+            "volume": random.randint(1000, 100000),
+        }
+        price = close
+
+    return json.dumps(
+        {
+            "data": {
+                "info": {"symbolId": symbol_id, "mode": "twse-sem"},
+                "chart": chart,
+            }
+        }
+    )
+
+
+def quote_message(symbol_id="2884", price=25.0):
+
+    return json.dumps(
+        {
+            "data": {
+                "info": {"symbolId": symbol_id, "mode": "twse-sem"},
+                "quote": {
+                    "trade": {"price": price, "unit": 1, "volume": 1000},
+                    "order": {
+                        "bestBids": [
+                            {"price": round(price - 0.05 * i, 2), "unit": i}
+                            for i in range(5)
+                        ],
+                        "bestAsks": [
+                            {
+                                "price": round(price + 0.05 * (i + 1), 2),
+                                "unit": i,
+                            }
+                            for i in range(5)
+                        ],
+                    },
+                },
+            }
+        }
+    )
+
+
+class traced_thread(threading.Thread):
+    # the trace hook the old create_Thread installed on every worker
+    def run(self):
+        sys.settrace(self.globaltrace)
+        threading.Thread.run(self)
+
+    def globaltrace(self, frame, event, arg):
+        if event == "call":
+            return self.localtrace
+        else:
+            return None
+
+    def localtrace(self, frame, event, arg):
+        return self.localtrace
+
+
+def throughput(on_message, messages, thread_class):
+
+    result = {}
+
+    def run():
+        start = time.perf_counter()
+        for message in messages:
+            on_message(message)
+        result["seconds"] = time.perf_counter() - start
+
+    t = thread_class(target=run)
+    t.start()
+    t.join()
+
+    return len(messages) / result["seconds"]
+
+
+def bench_tracing(count=2000):
+
+    manager = stream_manager.get("benchmark")
+    chart = chart_websocket_api("benchmark", manager=manager)
+    quote = quote_websocket_api("benchmark", manager=manager)
+    chart.bars["2884"] = bar_builder()
+    quote.books["2884"] = order_book()
+
+    cases = [
+        (
+            "chart",
+            lambda message: chart.on_message(json.loads(message)),
+            [chart_message()] * (count // 10),
+        ),
+        (
+            "quote",
+            lambda message: quote.on_message(json.loads(message)),
+            [quote_message()] * count,
+        ),
+    ]
+
+    print("message handling throughput (messages/s)")
+    for name, on_message, messages in cases:
+        before = throughput(on_message, messages, traced_thread)
+        after = throughput(on_message, messages, threading.Thread)
+        print(
+            f"{name:>6}  settrace {before:10.0f}  "
+            f"plain {after:10.0f}  x{after / before:.1f}"
+        )
+
+    manager.close()
+
+
+def per_second(function, messages):
+
+    start = time.perf_counter()
+    for message in messages:
+        function(message)
+
+    return len(messages) / (time.perf_counter() - start)
+
+
+def bench_decoding(count=200):
+
+    decoder = message_decoder()
+    chart = chart_message()
+    cases = [
+        ("chart", "chart", chart),
+        ("oddlot", "chart", chart.replace("twse-sem", "twse-sem-oddlot")),
+        ("quote", "quote", quote_message()),
+    ]
+
+    print("message decoding throughput (messages/s)")
+    for name, channel, raw in cases:
+        messages = [raw] * count
+        before = per_second(json.loads, messages)
+        after = per_second(lambda raw: decoder.decode(channel, raw), messages)
+        print(
+            f"{name:>6}  json {before:10.0f}  "
+            f"decoder {after:10.0f}  x{after / before:.1f}"
+        )
+
+
+def record_quotes(path, count, interval=0.001):
+
+    recorder = message_recorder(path)
+    start = time.time()
+    for i in range(count):
+        price = round(25 + 0.05 * random.randint(-10, 10), 2)
+        recorder.write(
+            "2884", "quote", quote_message(price=price), start + i * interval
+        )
+    recorder.close()
+
+
+def replay(path, speed, count):
+
+    server = replay_server(path, speed=speed, port=8766).start()
+    manager = stream_manager("benchmark", endpoint=server.endpoint)
+    quote = quote_websocket_api("benchmark", manager=manager)
+    quote.watch("2884")
+
+    received = []
+    done = threading.Event()
+
+    def render(message):
+        df_quote, price_list, symbol = quote.update_quote_data("2884")
+        quote.plot_order_book_table(df_quote, price_list, symbol)
+        received.append(time.perf_counter())
+        if len(received) == count:
+            done.set()
+
+    manager.subscribe("2884", "quote", render)
+    done.wait(60)
+    manager.close()
+    server.close()
+
+    return received
+
+
+def bench_replay(count=500, interval=0.01, speeds=(None, 1, 5)):
+
+    path = os.path.join(tempfile.mkdtemp(), "quote.tsv")
+    record_quotes(path, count, interval)
+
+    print("replayed tick-to-render")
+    for speed in speeds:
+        received = replay(path, speed, count)
+        seconds = received[-1] - received[0]
+        # every tick is due interval / speed after the one before it
+        lag = [
+            at - (received[0] + i * interval / speed) if speed else 0
+            for i, at in enumerate(received)
+        ]
+        print(
+            f"{'max' if speed is None else f'{speed}x':>6}  "
+            f"{len(received) / seconds:10.0f} messages/s  "
+            f"lag mean {1000 * sum(lag) / len(lag):8.3f} ms  "
+            f"max {1000 * max(lag):8.3f} ms"
+        )
+
+
+def measure(function, number=20):
+
+    # latency is the best of a few batches, allocations the peak of one call
+    function()
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def report(name, function, number=20):
+
+    seconds, peak = measure(function, number)
+    print(f"{name:<36} {1e6 * seconds:12.1f} us {peak / 1024:10.1f} KiB")
+
+
+def feed_chart(chart, symbol_id, minutes):
+
+    chart.bars[symbol_id] = bar_builder()
+    chart.last_read[symbol_id] = float("inf")
+    message = json.loads(chart_message(symbol_id, minutes))
+    chart.on_message(message)
+
+    return message
+
+
+class offline_manager(stream_manager):
+    # keeps the handlers but never connects, the benchmark feeds them
+    def add(self, key, on_message, on_reconnect=None):
+        self.handlers.setdefault(key, []).append(on_message)
+
+
+def bench_hot_paths(
+    minutes=(30, 135, 270), symbols=(1, 10, 50), rules=(10, 100, 1000)
+):
+
+    manager = offline_manager("benchmark")
+    chart = chart_websocket_api("benchmark", manager=manager)
+    quote = quote_websocket_api("benchmark", manager=manager)
+
+    print(f"{'hot path':<36} {'per call':>15} {'peak alloc':>14}")
+    feed_chart(chart, "2884", 270)
+    for n in (1, 5, 15, 30):
+        report(
+            f"get_chart_data n={n}",
+            lambda: chart.get_chart_data(n, "2884"),
+        )
+
+    df_ohlc = chart.get_chart_data(5, "2884")
+    report(
+        "plot_volume_bar n=5",
+        lambda: chart.plot_volume_bar(df_ohlc, "red", "green"),
+    )
+    report("plot_MA n=5 window=5", lambda: chart.plot_MA(df_ohlc, 5, "b", 2))
+
+    message = json.loads(quote_message())
+    report("get_new_quote_data", lambda: quote.get_new_quote_data(message))
+    df_quote, price_list, symbol = quote.get_new_quote_data(message)
+    report(
+        "plot_order_book",
+        lambda: quote.plot_order_book(df_quote, price_list, symbol),
+    )
+
+    # a cold builder replays the whole chart message before the frame
+    for count in minutes:
+        message = feed_chart(chart, "2884", count)
+
+        def cold():
+            chart.bars["2884"] = bar_builder()
+            chart.on_message(message)
+            chart.get_chart_data(1, "2884")
+
+        report(f"cold get_chart_data bars={count}", cold, 5)
+
+    for count in symbols:
+        symbol_ids = [str(2000 + i) for i in range(count)]
+        for symbol_id in symbol_ids:
+            feed_chart(chart, symbol_id, 270)
+        report(
+            f"get_chart_data n=5 symbols={count}",
+            lambda: [chart.get_chart_data(5, s) for s in symbol_ids],
+            5,
+        )
+
+    manager.close()
+
+    # the alert rules are spread around the price, every tick moves it by
+    # one tick size
+    manager = offline_manager("benchmark")
+    ticks = [
+        {
+            "data": {
+                "info": {"symbolId": "2884"},
+                "quote": {"trade": {"price": round(25 + 0.05 * i, 2)}},
+            }
+        }
+        for i in list(range(-20, 20)) + list(range(20, -20, -1))
+    ]
+    for count in rules:
+        alerts = []
+        engine = tick_alert_engine(
+            "benchmark",
+            alerts.append,
+            [
+                ("2884", "price", 25 + 5 * i / count, 25 - 5 * i / count)
+                for i in range(count // 2)
+            ]
+            + [
+                ("2884", "change", 0.2 * i / count, 0.2 * i / count)
+                for i in range(count // 2)
+            ],
+            hysteresis=0.005,
+            manager=manager,
+            references={"2884": 25.0},
+        )
+
+        def tick():
+            for message in ticks:
+                engine.on_message(message)
+
+        seconds, peak = measure(tick, 5)
+        print(
+            f"{f'tick_alert_engine rules={count}':<36} "
+            f"{1e6 * seconds / len(ticks):12.1f} us {peak / 1024:10.1f} KiB"
+        )
+        engine.close()
+
+    manager.close()
+
+
+if __name__ == "__main__":
+    bench_tracing()
+    bench_decoding()
+    bench_replay()
+    bench_hot_paths()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import json
+import threading
+import time
+
+import websockets
+
+import fugle_realtime_websocket_api
+from fugle_realtime_websocket_api import *
+from benchmark import chart_message, offline_manager, quote_message
+
+
+class stub_server:
+    # a local websocket that misbehaves the way an upstream can: "drop"
+    # closes right after the handshake, "reject" sends one error frame and
+    # closes, "hold" streams for a while and closes, "flap" does "reject"
+    # once and then streams for good
+    def __init__(self, mode, hold=1.2, host="127.0.0.1"):
+        self.mode = mode
+        self.hold = hold
+        self.host = host
+        self.connections = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="stub_server", daemon=True
+        )
+
+    @property
+    def endpoint(self):
+        return "ws://%s:%d/" % (self.host, self.port)
+
+    def start(self):
+        async def serve():
+            return await websockets.serve(self.serve, self.host, 0)
+
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            serve(), self.loop
+        ).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+
+        return self
+
+    def close(self):
+        self.server.close()
+        asyncio.run_coroutine_threadsafe(
+            self.server.wait_closed(), self.loop
+        ).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def serve(self, ws, path):
+        self.connections.append(time.monotonic())
+        mode = self.mode
+        if mode == "flap":
+            mode = "reject" if len(self.connections) == 1 else "stream"
+
+        try:
+            if mode == "reject":
+                await ws.send(json.dumps({"error": {"message": "rejected"}}))
+            elif mode in ("hold", "stream"):
+                stop = time.monotonic() + (self.hold if mode == "hold" else 60)
+                while time.monotonic() < stop:
+                    await ws.send(quote_message())
+                    await asyncio.sleep(0.02)
+        except websockets.ConnectionClosed:
+            pass
+
+
+def run_stream(server, seconds, policy, on_reconnect=None):
+
+    received = []
+    manager = stream_manager("check", endpoint=server.endpoint, policy=policy)
+    manager.subscribe(
+        "2884",
+        "quote",
+        lambda message: received.append(time.monotonic()),
+        on_reconnect,
+    )
+    time.sleep(seconds)
+    manager.close()
+
+    return received
+
+
+def check_backoff(seconds=3):
+
+    # a server that closes at once, with or without a frame, must be
+    # retried after growing delays instead of every policy.first seconds
+    policy = reconnect_policy(first=0.05, base=0.1, cap=1, stable=1)
+    for mode in ("drop", "reject"):
+        server = stub_server(mode).start()
+        run_stream(server, seconds, policy)
+        server.close()
+
+        at = server.connections
+        gaps = [b - a for a, b in zip(at, at[1:])]
+        print(
+            f"{mode:<8} {len(at):3d} connections in {seconds} s, "
+            f"gaps {gaps[0]:.2f} s to {gaps[-1]:.2f} s"
+        )
+        assert len(at) <= 12, "reconnected without backing off"
+        assert gaps[-1] > 4 * gaps[0], "the delays did not grow"
+
+
+def check_stable_reset(seconds=3):
+
+    # a connection that stayed up policy.stable seconds was healthy, so
+    # the next one is retried after policy.first again
+    policy = reconnect_policy(first=0.05, base=0.5, cap=1, stable=1)
+    server = stub_server("hold", hold=1.2).start()
+    run_stream(server, seconds, policy)
+    server.close()
+
+    at = server.connections
+    gaps = [b - a - 1.2 for a, b in zip(at, at[1:])]
+    print(f"stable   {len(at):3d} connections, retried after {gaps} s")
+    assert len(at) >= 2 and max(gaps) < 0.3, "the backoff was not reset"
+
+
+def check_hanging_backfill(seconds=3):
+
+    # a backfill whose request hangs holds the stream for policy.timeout
+    # seconds at most
+    release = threading.Event()
+    policy = reconnect_policy(first=0.05, stable=1, timeout=0.5)
+    server = stub_server("flap").start()
+    received = run_stream(
+        server, seconds, policy, lambda symbol_id, channel: release.wait(30)
+    )
+    release.set()
+    server.close()
+
+    assert len(server.connections) == 2, "the stream did not reconnect"
+    received = [at for at in received if at > server.connections[1]]
+    assert received, "no messages arrived after the reconnect"
+    wait = received[0] - server.connections[1]
+    print(f"backfill hung, first message {wait:.2f} s after the reconnect")
+    assert wait < policy.timeout + 0.5, "the stream waited for the backfill"
+
+
+class error_intraday:
+    # answers every REST request with an error payload
+    error = {"apiVersion": "0.1.0", "error": {"code": 401}}
+
+    def chart(self, symbolId, apiToken, output="raw"):
+        return self.error
+
+    def quote(self, symbolId, apiToken, output="raw"):
+        return self.error
+
+
+def check_backfill_payloads():
+
+    # an error payload from REST leaves the minutes and the book as they are
+    fugle_realtime_websocket_api.intraday = error_intraday()
+    manager = offline_manager("check")
+
+    chart = chart_websocket_api("check", manager=manager)
+    bar = chart.watch("2884")
+    chart.on_message(json.loads(chart_message("2884", 30)))
+    last, version = bar.last, bar.version
+    chart.backfill("2884")
+    assert (bar.last, bar.version) == (last, version), "the day was reset"
+
+    quote = quote_websocket_api("check", manager=manager)
+    quote.watch("2884")
+    quote.on_message(json.loads(quote_message()))
+    quote.backfill("2884")
+    df_quote, price_list, symbol = quote.update_quote_data("2884")
+    assert len(price_list), "the book was replaced by an empty one"
+
+    manager.close()
+    print("error payloads skipped by both backfills")
+
+
+if __name__ == "__main__":
+    check_backoff()
+    check_stable_reset()
+    check_hanging_backfill()
+    check_backfill_payloads()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+from fugle_realtime import intraday
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
@@ -9,175 +11,677 @@ from dash.dependencies import Input, Output, State
 import pandas as pd
 import numpy as np
 import datetime
-import websocket
+import os
 import sys
-import trace
 import threading
 import time
 import requests
 import json
+import random
+import itertools
+import logging
+import urllib.parse
+import asyncio
+import websockets
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the bar core is shared with the REST demo, one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fugle_realtime_core import (
+    alert_bounds,
+    alert_message,
+    alert_value,
+    bar_builder,
+    bar_store,
+    bollinger,
+    ema,
+    frame_indicator,
+    metrics,
+    order_book,
+    session_calendar,
+    sma,
+    volume_color,
+    vwap,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class snapshot_store:
+    def __init__(self):
+        self.slots = {}
+        self.sequence = itertools.count(1)
+
+    def put(self, symbol_id, channel, message):
+        # replacing the whole (sequence, message) tuple is a single atomic
+        # store, so readers never need a lock and never see a torn update
+        self.slots[(symbol_id, channel)] = (next(self.sequence), message)
+
+    def get(self, symbol_id, channel):
+        return self.slots.get((symbol_id, channel), (0, None))
+
+
+class figure_cache:
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = {}
+
+    def get(self, key, version, build):
+        # figures are rebuilt only once the data behind them has changed
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            metrics.count("figure_cache_hits_total")
+            return entry[1]
+
+        timer = metrics.start()
+        value = build()
+        metrics.stop("figure_build_seconds", timer)
+        if key not in self.entries and len(self.entries) >= self.size:
+            self.entries.clear()
+        self.entries[key] = (version, value)
+
+        return value
+
+
+class quote_record:
+    __slots__ = ("symbol_id", "bids", "asks", "trade")
+    level_dtype = order_book.level_dtype
+    trade_dtype = np.dtype(
+        [
+            ("at", "datetime64[ms]"),
+            ("price", float),
+            ("unit", float),
+            ("volume", float),
+            ("serial", np.int64),
+        ]
+    )
+
+    def __init__(self, symbol_id, bids, asks, trade=None):
+        self.symbol_id = symbol_id
+        self.bids = bids
+        self.asks = asks
+        self.trade = trade
+
+
+class message_decoder:
+    def __init__(self, loads=None, skip_modes=("-oddlot",)):
+        self.loads = loads or (orjson.loads if orjson else json.loads)
+        self.skip_modes = [(mode, mode.encode()) for mode in skip_modes]
+
+    def skip(self, channel, raw):
+        # the mode shows up in the raw text, so odd lot charts are dropped
+        # before the whole day of minutes is decoded
+        if channel != "chart":
+            return False
+        text = isinstance(raw, str)
+        return any(
+            (mode if text else encoded) in raw
+            for mode, encoded in self.skip_modes
+        )
 
+    def decode(self, channel, raw):
+        if self.skip(channel, raw):
+            return None
+        return self.loads(raw)
+
+    @staticmethod
+    def levels(levels):
+        return order_book.levels(levels)
+
+    @staticmethod
+    def trade(trade):
+        # exchange times are UTC, e.g. 2020-03-05T05:30:00.000Z
+        at = trade.get("at")
+        return np.array(
+            (
+                np.datetime64(at[:-1] if at else "NaT"),
+                trade["price"],
+                trade["unit"],
+                trade["volume"],
+                trade.get("serial", -1),
+            ),
+            dtype=quote_record.trade_dtype,
+        )[()]
+
+    @staticmethod
+    def chart(message):
+        data = message["data"]
+        info = data["info"]
+        return info["symbolId"], info["mode"], data["chart"]
+
+    @staticmethod
+    def quote(message):
+        data = message["data"]
+        order = data["quote"].get("order") or {}
+        trade = data["quote"].get("trade")
+        return quote_record(
+            data["info"]["symbolId"],
+            message_decoder.levels(order.get("bestBids", [])),
+            message_decoder.levels(order.get("bestAsks", [])),
+            message_decoder.trade(trade) if trade else None,
+        )
 
-class create_Thread(threading.Thread):
-    def __init__(self, *args, **keywords):
-        threading.Thread.__init__(self, *args, **keywords)
-        self.killed = False
 
-    def start(self):
-        self.__run_backup = self.run
-        self.run = self.__run
-        threading.Thread.start(self)
-
-    def __run(self):
-        sys.settrace(self.globaltrace)
-        self.__run_backup()
-        self.run = self.__run_backup
-
-    def globaltrace(self, frame, event, arg):
-        if event == "call":
-            return self.localtrace
-        else:
-            return None
+class reconnect_policy:
+    def __init__(
+        self, first=0.05, base=0.5, cap=30, stable=5, backfill=5, timeout=5
+    ):
+        self.first = first
+        self.base = base
+        self.cap = cap
+        self.stable = stable
+        self.backfill = backfill
+        self.timeout = timeout
+
+    def delay(self, attempt):
+        # a blip is retried almost at once, a longer outage backs off
+        # exponentially with jitter so symbols do not reconnect in lockstep
+        if attempt == 0:
+            return self.first
+        # the exponent is bounded so a long outage never overflows a float
+        delay = min(self.cap, self.base * 2 ** min(attempt - 1, 64))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class stream_manager:
+    instances = {}
+    instances_lock = threading.Lock()
+
+    endpoint = "wss://api.fugle.tw/realtime/v0/intraday/"
+
+    def __init__(
+        self,
+        api_token,
+        decoder=None,
+        endpoint=None,
+        recorder=None,
+        policy=None,
+    ):
+        self.api_token = api_token
+        self.handlers = {}
+        self.recovers = {}
+        self.recovered = {}
+        self.tasks = {}
+        self.store = snapshot_store()
+        self.decoder = decoder or message_decoder()
+        self.endpoint = endpoint or self.endpoint
+        self.recorder = recorder
+        self.policy = policy or reconnect_policy()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="stream_manager", daemon=True
+        )
+        self.thread.start()
+
+    @classmethod
+    def get(cls, api_token):
+        with cls.instances_lock:
+            if api_token not in cls.instances:
+                cls.instances[api_token] = cls(api_token)
+            return cls.instances[api_token]
+
+    def url(self, symbol_id, channel):
+        return (
+            self.endpoint
+            + channel
+            + "?symbolId="
+            + symbol_id
+            + "&apiToken="
+            + self.api_token
+        )
 
-    def localtrace(self, frame, event, arg):
-        if self.killed:
-            if event == "line":
-                raise SystemExit()
-        return self.localtrace
+    def subscribe(self, symbol_id, channel, on_message, on_reconnect=None):
+        self.loop.call_soon_threadsafe(
+            self.add, (symbol_id, channel), on_message, on_reconnect
+        )
 
-    def kill(self):
-        self.killed = True
+    def unsubscribe(self, symbol_id, channel, on_message):
+        self.loop.call_soon_threadsafe(
+            self.remove, (symbol_id, channel), on_message
+        )
 
+    def add(self, key, on_message, on_reconnect=None):
+        self.handlers.setdefault(key, []).append(on_message)
+        if on_reconnect is not None:
+            self.recovers.setdefault(key, {})[on_message] = on_reconnect
+        if key not in self.tasks:
+            self.tasks[key] = self.loop.create_task(self.stream(*key))
+
+    def remove(self, key, on_message):
+        handlers = self.handlers.get(key, [])
+        if on_message in handlers:
+            handlers.remove(on_message)
+        self.recovers.get(key, {}).pop(on_message, None)
+
+        if not handlers:
+            self.handlers.pop(key, None)
+            self.recovers.pop(key, None)
+            self.recovered.pop(key, None)
+            task = self.tasks.pop(key, None)
+            if task is not None:
+                task.cancel()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+        with self.instances_lock:
+            if self.instances.get(self.api_token) is self:
+                del self.instances[self.api_token]
+
+    async def shutdown(self):
+        tasks = list(self.tasks.values())
+        self.tasks.clear()
+        self.handlers.clear()
+        self.recovers.clear()
+        self.recovered.clear()
+
+        # cancelling a stream leaves its connect() block, which sends the
+        # websocket close frame, so no thread ever has to be killed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def lag(message):
+        # seconds between the exchange update and its arrival here
+        data = message.get("data", {})
+        at = data.get("info", {}).get("lastUpdatedAt")
+        if at is None:
+            at = (data.get("quote", {}).get("trade") or {}).get("at")
+        if at is None:
+            return None
 
-class chart_websocket_api:
-    def __init__(self, api_token):
+        at = datetime.datetime.strptime(at, "%Y-%m-%dT%H:%M:%S.%fZ")
+        at = at.replace(tzinfo=datetime.timezone.utc)
+        return time.time() - at.timestamp()
+
+    def handle(self, symbol_id, channel, raw):
+        # labels are only formatted while metrics are on, so the hot path
+        # of a disabled dashboard does no string work at all
+        key = (symbol_id, channel)
+        if metrics.enabled:
+            metrics.count('messages_received_total{channel="%s"}' % channel)
+        if self.recorder is not None:
+            self.recorder.write(symbol_id, channel, raw)
+
+        timer = metrics.start()
+        message = self.decoder.decode(channel, raw)
+        if timer is not None:
+            metrics.stop('decode_seconds{channel="%s"}' % channel, timer)
+        if message is None:
+            return
+
+        if metrics.enabled and isinstance(message, dict):
+            lag = self.lag(message)
+            if lag is not None:
+                metrics.observe(
+                    'message_lag_seconds{channel="%s"}' % channel, lag
+                )
 
-        self.api_token = api_token
+        timer = metrics.start()
+        for on_message in list(self.handlers.get(key, [])):
+            try:
+                on_message(message)
+            except Exception as error:
+                metrics.error("on_message", error)
+        if timer is not None:
+            metrics.stop('handle_seconds{channel="%s"}' % channel, timer)
+
+    async def recover(self, symbol_id, channel):
+        # the handlers fill what they missed over REST, off the loop so the
+        # other streams keep flowing, before the new messages are handled;
+        # a flapping stream backfills at most once per policy.backfill
+        # seconds, as the messages after a reconnect carry the latest state,
+        # and a request that hangs holds the stream for policy.timeout
+        # seconds at most
+        key = (symbol_id, channel)
+        now = time.monotonic()
+        last = self.recovered.get(key)
+        if last is not None and now - last < self.policy.backfill:
+            return
+        self.recovered[key] = now
+
+        for on_reconnect in list(self.recovers.get(key, {}).values()):
+            timer = metrics.start()
+            try:
+                await asyncio.wait_for(
+                    self.loop.run_in_executor(
+                        None, on_reconnect, symbol_id, channel
+                    ),
+                    self.policy.timeout,
+                )
+            except asyncio.TimeoutError:
+                metrics.error("backfill", (symbol_id, channel, "timed out"))
+            except Exception as error:
+                metrics.error("backfill", (symbol_id, channel, error))
+            if timer is not None:
+                metrics.stop('backfill_seconds{channel="%s"}' % channel, timer)
+
+    async def stream(self, symbol_id, channel):
+        attempt = 0
+        connected = False
+        opened = None
+
+        while True:
+            try:
+                async with websockets.connect(
+                    self.url(symbol_id, channel)
+                ) as ws:
+                    if connected:
+                        if metrics.enabled:
+                            metrics.count(
+                                'reconnects_total{channel="%s"}' % channel
+                            )
+                        await self.recover(symbol_id, channel)
+                    connected = True
+                    opened = time.monotonic()
+                    async for message in ws:
+                        self.handle(symbol_id, channel, message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                metrics.error("stream", error)
+
+            # the backoff only starts over once a connection stayed up
+            # policy.stable seconds, so a server that accepts, maybe sends
+            # one rejection frame, and closes keeps backing off
+            if opened is not None:
+                if time.monotonic() - opened >= self.policy.stable:
+                    attempt = 0
+                opened = None
+
+            delay = self.policy.delay(attempt)
+            attempt += 1
+            logger.warning(
+                "%s %s stream closed, reconnecting in %.2f s",
+                symbol_id,
+                channel,
+                delay,
+            )
+            await asyncio.sleep(delay)
+
+
+class message_recorder:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+        self.lock = threading.Lock()
+
+    def write(self, symbol_id, channel, raw, at=None):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+
+        # newlines inside a JSON string are always escaped, so the ones left
+        # are whitespace and every message fits on one line
+        line = "%.6f\t%s\t%s\t%s\n" % (
+            at or time.time(),
+            channel,
+            symbol_id,
+            raw.replace("\r", " ").replace("\n", " "),
+        )
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def read(path):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                at, channel, symbol_id, raw = line.rstrip("\n").split("\t", 3)
+                yield float(at), channel, symbol_id, raw
+
+
+class replay_server:
+    def __init__(self, path, speed=1, host="127.0.0.1", port=8765):
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.messages = {}
+        for at, channel, symbol_id, raw in message_recorder.read(path):
+            self.messages.setdefault((symbol_id, channel), []).append(
+                (at, raw)
+            )
 
-    def chart_websocket(self, symbol_id):
-        this = self
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="replay_server", daemon=True
+        )
 
-        def _wrap(f, *args):
-            return lambda *a: f(*(a + args))
+    @property
+    def endpoint(self):
+        return "ws://%s:%d/" % (self.host, self.port)
 
-        def on_message(ws, message):
-            message = json.loads(message)
-            if "-oddlot" not in message["data"]["info"]["mode"]:
-                self.chart_msg = message
+    def start(self):
+        async def serve():
+            return await websockets.serve(self.play, self.host, self.port)
+
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            serve(), self.loop
+        ).result()
+
+        return self
+
+    def close(self):
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def play(self, ws, path):
+        url = urllib.parse.urlparse(path)
+        channel = url.path.rsplit("/", 1)[-1]
+        symbol_id = urllib.parse.parse_qs(url.query)["symbolId"][0]
+        messages = self.messages.get((symbol_id, channel), [])
+
+        # recorded gaps are replayed divided by speed, or skipped entirely
+        # when speed is None
+        start = time.monotonic()
+        first = messages[0][0] if messages else 0
+        try:
+            for at, raw in messages:
+                if self.speed:
+                    delay = (
+                        start + (at - first) / self.speed - time.monotonic()
+                    )
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await ws.send(raw)
+        except websockets.ConnectionClosed:
+            return
 
-        def on_error(ws, error):
-            print(error)
+        # the live service never hangs up either
+        await ws.wait_closed()
 
-        def on_close(ws):
-            print("### closed ###")
 
-        websocket.enableTrace(False)
-        ws = websocket.WebSocketApp(
-            "wss://api.fugle.tw/realtime/v0/intraday/chart?symbolId="
-            + symbol_id
-            + "&apiToken="
-            + self.api_token,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=lambda ws: (
-                time.sleep(10),
-                _wrap(chart_websocket_api._ws, symbol_id)(this),
-            ),
+class relay_decoder(message_decoder):
+    def decode(self, channel, raw):
+        # the hub forwards the upstream text as it is, so only the odd lot
+        # filter runs and every client decodes just once, by itself
+        return None if self.skip(channel, raw) else raw
+
+
+class relay_hub:
+    def __init__(self, api_token, host="127.0.0.1", port=8765, manager=None):
+        self.host = host
+        self.port = port
+        self.manager = manager or stream_manager(
+            api_token, decoder=relay_decoder()
         )
-        ws.run_forever()
+        self.clients = {}
+        self.handlers = {}
+        self.latest = {}
 
-    def get_chart_msg(self, symbol_id):
+    @property
+    def endpoint(self):
+        return "ws://%s:%d/" % (self.host, self.port)
 
-        try:
-            symbol = self.chart_msg["data"]["info"]["symbolId"]
+    def start(self):
+        async def serve():
+            return await websockets.serve(self.relay, self.host, self.port)
 
-            if symbol_id != symbol:
+        self.server = asyncio.run_coroutine_threadsafe(
+            serve(), self.manager.loop
+        ).result()
 
-                while [
-                    i
-                    for i in threading.enumerate()
-                    if i.name == symbol + "chart"
-                ] != []:
+        return self
 
-                    [
-                        i
-                        for i in threading.enumerate()
-                        if i.name == symbol + "chart"
-                    ][0].kill()
+    def close(self):
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
 
-                    time.sleep(1)
+        asyncio.run_coroutine_threadsafe(
+            shutdown(), self.manager.loop
+        ).result()
+        self.manager.close()
 
-                print("kill complete！")
-                t = create_Thread(
-                    target=self.chart_websocket,
-                    args=[symbol_id],
-                    name=symbol_id + "chart",
-                )
-                t.start()
-                time.sleep(2)
+    def fan_out(self, key, raw):
+        self.latest[key] = raw
+        for ws in list(self.clients.get(key, ())):
+            self.manager.loop.create_task(self.send(ws, raw))
 
-            else:
-                print("pass")
+    async def send(self, ws, raw):
+        try:
+            await ws.send(raw)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def relay(self, ws, path):
+        url = urllib.parse.urlparse(path)
+        channel = url.path.rsplit("/", 1)[-1]
+        key = (urllib.parse.parse_qs(url.query)["symbolId"][0], channel)
+
+        # the first client of a symbol opens the upstream subscription and
+        # the last one to leave closes it; everything runs on the loop of
+        # the manager, so the counts need no lock
+        clients = self.clients.setdefault(key, set())
+        if not clients:
+            self.handlers[key] = lambda raw: self.fan_out(key, raw)
+            self.manager.add(key, self.handlers[key])
+        clients.add(ws)
+        if metrics.enabled:
+            metrics.count('relay_clients_total{channel="%s"}' % channel)
 
-        except (NameError, AttributeError):
-            t = create_Thread(
-                target=self.chart_websocket,
-                args=[symbol_id],
-                name=symbol_id + "chart",
-            )
-            t.start()
-            time.sleep(2)
-            print("new")
+        try:
+            if key in self.latest:
+                await ws.send(self.latest[key])
+            await ws.wait_closed()
+        finally:
+            clients.discard(ws)
+            if not clients:
+                del self.clients[key]
+                self.latest.pop(key, None)
+                self.manager.remove(key, self.handlers.pop(key))
 
-    def get_chart_data(self, n, symbol_id):
 
-        self.get_chart_msg(symbol_id)
+class chart_websocket_api:
+    def __init__(self, api_token, manager=None, idle_timeout=60, store=None):
 
-        now = datetime.datetime.now()
-        today = now.strftime("%Y-%m-%d")
-        close_time = datetime.datetime(now.year, now.month, now.day, 13, 30)
+        self.api_token = api_token
+        self.manager = manager or stream_manager.get(api_token)
+        self.idle_timeout = idle_timeout
+        self.store = store
+        self.bars = {}
+        self.last_read = {}
+        self.figures = figure_cache()
+        self.lock = threading.Lock()
+
+    def on_message(self, message):
+
+        symbol, mode, chart = message_decoder.chart(message)
+        bar = self.bars.get(symbol)
+
+        if bar is not None and "-oddlot" not in mode:
+            # the minutes live on in the bar builder, so only the newest
+            # one is kept as the snapshot instead of the whole message
+            bar.update(symbol, chart)
+            self.manager.store.put(symbol, "chart", bar.records(bar.last))
+
+    def watch(self, symbol_id):
+
+        with self.lock:
+            now = time.monotonic()
+            self.last_read[symbol_id] = now
+
+            if symbol_id not in self.bars:
+                # with a store the minutes of today are back at once
+                self.bars[symbol_id] = bar_builder(self.store)
+                self.bars[symbol_id].reset(
+                    symbol_id, datetime.date.today().isoformat()
+                )
+                self.manager.subscribe(
+                    symbol_id, "chart", self.on_message, self.backfill
+                )
+
+            # symbols nobody has asked for in a while are unsubscribed
+            for idle in [
+                symbol
+                for symbol, last in self.last_read.items()
+                if now - last > self.idle_timeout
+            ]:
+                self.manager.unsubscribe(idle, "chart", self.on_message)
+                del self.bars[idle], self.last_read[idle]
+
+            return self.bars[symbol_id]
+
+    def backfill(self, symbol_id, channel="chart"):
 
-        time_index = pd.date_range(
-            start=f"{today} 09:00:00",
-            end=f"{today} 13:30:00",
-            freq=f"{n}T",
-            closed="right",
+        bar = self.bars.get(symbol_id)
+        if bar is None:
+            return
+
+        # the builder resumes from the last minute it has, so only the
+        # minutes missed while disconnected are merged
+        chart = intraday.chart(
+            symbolId=symbol_id, apiToken=self.api_token, output="raw"
         )
+        try:
+            bar.update(symbol_id, chart)
+        except ValueError as error:
+            # an error payload is skipped before it can reset the day
+            metrics.error("backfill", (symbol_id, error))
 
-        df_time = pd.DataFrame(time_index, columns=["at"])
+    def get_chart_msg(self, symbol_id):
 
-        ohlc = self.chart_msg["data"]["chart"]
-        df = pd.DataFrame(ohlc.values())
+        return self.watch(symbol_id).records()
 
-        df["at"] = pd.DataFrame(ohlc.keys())
-        df["at"] = pd.to_datetime(df["at"]).dt.tz_localize(
-            None
-        ) + datetime.timedelta(hours=8)
-        df = df.set_index("at")
+    def get_version(self, symbol_id):
 
-        df = df.asfreq("1T")
-        df["close"] = df["close"].fillna(method="ffill")
-        df["volume"] = df["volume"].fillna(0)
-        df = df.fillna(axis=1, method="ffill")
+        return self.watch(symbol_id).version
 
-        df_ohlc = df.resample(f"{n}T", kind="period").agg(
-            {
-                "open": "first",
-                "high": "max",
-                "low": "min",
-                "close": "last",
-                "volume": "sum",
-            }
+    def get_figure(self, symbol_id, key, build):
+
+        return self.figures.get(
+            (symbol_id, key), self.get_version(symbol_id), build
         )
 
-        df_ohlc.index = df_ohlc.index + datetime.timedelta(minutes=n - 1)
+    def get_chart_data(self, n, symbol_id, date=None):
 
-        df_ohlc = df_ohlc.to_timestamp().reset_index()
-        df_ohlc = pd.merge(df_time, df_ohlc, on="at", how="outer")
-        df_ohlc["at"] = df_ohlc["at"].apply(
-            lambda x: x if x <= close_time else close_time
-        )
-        df_ohlc["at"] = df_ohlc["at"].astype(str)
+        if date is None:
+            bar = self.watch(symbol_id)
+        else:
+            # earlier days come from the store without a subscription
+            bar = bar_builder()
+            if self.store is not None and date in self.store.dates(symbol_id):
+                bar.store = self.store
+            bar.reset(symbol_id, date)
+
+        df_ohlc = bar.to_frame(n)
+        df_ohlc["at"] = session_calendar.get(n, bar.day()).labels[
+            : len(df_ohlc)
+        ]
 
         return df_ohlc
 
@@ -197,41 +701,61 @@ class chart_websocket_api:
             "decreasing": {"line": {"color": down_color}},
         }
 
-    def plot_MA(self, df, n, line_color, line_width):
+    def get_indicator(self, df, name, window=None):
 
-        df[f"{n}MA"] = df["close"].rolling(n).mean()
+        return frame_indicator(
+            self.bars.get(df.attrs.get("symbol_id")), df, name, window
+        )
+
+    def plot_line(self, df, y, name, line_color, line_width):
 
         return {
             "type": "scatter",
             "x": df["at"],
-            "y": df[f"{n}MA"],
+            "y": y,
             "mode": "lines",
             "line": {"color": line_color, "width": line_width},
-            "name": f"{n}MA",
+            "name": name,
         }
 
-    def plot_volume_bar(self, df, rise_color, down_color):
+    def plot_MA(self, df, n, line_color, line_width):
 
-        color = []
-        for i in range(len(df)):
-            try:
-                if df["close"][i] > df["open"][i]:
-                    color.append(rise_color)
+        y = self.get_indicator(df, "sma", n)["sma"]
+
+        return self.plot_line(df, y, f"{n}MA", line_color, line_width)
+
+    def plot_EMA(self, df, n, line_color, line_width):
 
-                elif df["close"][i] < df["open"][i]:
-                    color.append(down_color)
+        y = self.get_indicator(df, "ema", n)["ema"]
 
-                elif df["close"][i] == df["open"][i]:
+        return self.plot_line(df, y, f"{n}EMA", line_color, line_width)
 
-                    if df["close"][i] > df["close"][i - 1]:
-                        color.append(rise_color)
-                    elif df["close"][i] < df["close"][i - 1]:
-                        color.append(down_color)
-                    elif df["close"][i] == df["close"][i - 1]:
-                        color.append(color[-1])
+    def plot_VWAP(self, df, line_color, line_width):
 
-            except (IndexError, KeyError):
-                color.append(rise_color)
+        y = self.get_indicator(df, "vwap")["vwap"]
+
+        return self.plot_line(df, y, "VWAP", line_color, line_width)
+
+    def plot_bollinger(self, df, n, line_color, line_width):
+
+        bands = self.get_indicator(df, "bollinger", n)
+
+        return [
+            self.plot_line(
+                df, bands["upper"], f"{n}BB upper", line_color, line_width
+            ),
+            self.plot_line(
+                df, bands["lower"], f"{n}BB lower", line_color, line_width
+            ),
+        ]
+
+    def volume_color(self, df, rise_color, down_color, color=None):
+
+        return volume_color(df, rise_color, down_color, color)
+
+    def plot_volume_bar(self, df, rise_color, down_color, color=None):
+
+        color = self.volume_color(df, rise_color, down_color, color)
 
         return {
             "type": "bar",
@@ -243,173 +767,240 @@ class chart_websocket_api:
             "yaxis": "y2",
         }
 
-    _ws = chart_websocket
+
+class trade_tape:
+    def __init__(self, size=10000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, date=None):
+        self.date = date
+        self.trades = np.zeros(self.size, dtype=quote_record.trade_dtype)
+        self.count = 0
+        self.profile = {}
+        self.cumulative_unit = 0.0
+        self.cumulative_volume = 0.0
+        self.last = None
+
+    def append(self, trade):
+        with self.lock:
+            # a trade is repeated by every quote until the next one prints
+            if self.last is not None and (
+                trade["serial"] == self.last["serial"]
+                if trade["serial"] >= 0
+                else trade.tolist() == self.last.tolist()
+            ):
+                return False
+
+            date = trade["at"].astype("datetime64[D]")
+            if not np.isnat(date) and date != self.date:
+                self.reset(date)
+
+            self.trades[self.count % self.size] = trade
+            self.count += 1
+            self.last = trade.copy()
+
+            price = float(trade["price"])
+            self.profile[price] = self.profile.get(price, 0.0) + trade["unit"]
+            self.cumulative_unit += trade["unit"]
+            self.cumulative_volume += trade["volume"]
+
+            return True
+
+    def recent(self, count):
+        # the newest trades first, read straight out of the ring
+        with self.lock:
+            count = min(count, self.count, self.size)
+            index = (self.count - 1 - np.arange(count)) % self.size
+            return self.trades[index]
+
+    def time_and_sales(self, count=50):
+
+        trades = self.recent(count)
+
+        return pd.DataFrame(
+            {
+                # trade times are UTC, the tape shows Taipei time
+                "at": pd.DatetimeIndex(
+                    trades["at"] + np.timedelta64(8, "h")
+                ).strftime("%H:%M:%S"),
+                "price": trades["price"],
+                "unit": trades["unit"],
+            }
+        )
+
+    def volume_at_price(self):
+
+        with self.lock:
+            price = np.array(list(self.profile), dtype=float)
+            unit = np.array(list(self.profile.values()), dtype=float)
+
+        order = np.argsort(-price)
+        return pd.DataFrame({"price": price[order], "unit": unit[order]})
 
 
 class quote_websocket_api:
-    def __init__(self, api_token):
+    def __init__(self, api_token, manager=None, idle_timeout=60, depth=50):
         self.api_token = api_token
+        self.manager = manager or stream_manager.get(api_token)
+        self.idle_timeout = idle_timeout
+        self.depth = depth
+        self.books = {}
+        self.tapes = {}
+        self.last_read = {}
+        self.rows = {}
+        self.figures = figure_cache()
+        self.lock = threading.Lock()
+
+    def on_message(self, message):
 
-    def quote_websocket(self, symbol_id):
-        this = self
-
-        def _wrap(f, *args):
-            return lambda *a: f(*(a + args))
+        symbol = message["data"]["info"]["symbolId"]
+        if symbol in self.books:
+            record = message_decoder.quote(message)
+            self.manager.store.put(symbol, "quote", record)
+
+            tape = self.tapes.get(symbol)
+            if tape is not None and record.trade is not None:
+                tape.append(record.trade)
+
+    def watch(self, symbol_id):
+
+        with self.lock:
+            now = time.monotonic()
+            self.last_read[symbol_id] = now
+
+            if symbol_id not in self.books:
+                self.books[symbol_id] = order_book(self.depth)
+                self.books[symbol_id].reset(symbol_id)
+                self.tapes[symbol_id] = trade_tape()
+                self.manager.subscribe(
+                    symbol_id, "quote", self.on_message, self.backfill
+                )
 
-        def on_message(ws, message):
+            for idle in [
+                symbol
+                for symbol, last in self.last_read.items()
+                if now - last > self.idle_timeout
+            ]:
+                self.manager.unsubscribe(idle, "quote", self.on_message)
+                del self.books[idle], self.tapes[idle], self.last_read[idle]
 
-            global quote_msg
-            quote_msg = json.loads(message)
+            return self.books[symbol_id]
 
-        def on_error(ws, error):
-            print(error)
+    def backfill(self, symbol_id, channel="quote"):
 
-        def on_close(ws):
-            print("### closed ###")
+        if symbol_id not in self.books:
+            return
 
-        websocket.enableTrace(False)
-        ws = websocket.WebSocketApp(
-            "wss://api.fugle.tw/realtime/v0/intraday/quote?symbolId="
-            + symbol_id
-            + "&apiToken="
-            + self.api_token,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=lambda ws: (
-                time.sleep(10),
-                _wrap(quote_websocket_api._ws, symbol_id)(this),
+        # the REST quote is the "quote" part of a websocket message
+        quote = intraday.quote(
+            symbolId=symbol_id, apiToken=self.api_token, output="raw"
+        )
+        if not isinstance(quote, dict) or "order" not in quote:
+            # an error payload would replace the snapshot with an empty book
+            metrics.error("backfill", (symbol_id, "no order in the quote"))
+            return
+        self.manager.store.put(
+            symbol_id,
+            "quote",
+            message_decoder.quote(
+                {"data": {"info": {"symbolId": symbol_id}, "quote": quote}}
             ),
         )
-        ws.run_forever()
 
     def get_quote_msg(self, symbol_id):
 
-        try:
-            symbol = quote_msg["data"]["info"]["symbolId"]
-
-            if symbol_id != symbol:
-
-                while [
-                    i
-                    for i in threading.enumerate()
-                    if i.name == symbol + "quote"
-                ] != []:
-                    [
-                        i
-                        for i in threading.enumerate()
-                        if i.name == symbol + "quote"
-                    ][0].kill()
-
-                    time.sleep(1)
-
-                print("kill complete！")
-                t = create_Thread(
-                    target=self.quote_websocket,
-                    args=[symbol_id],
-                    name=symbol_id + "quote",
-                )
-                t.start()
+        self.watch(symbol_id)
 
-            else:
-                print("pass")
+        return self.manager.store.get(symbol_id, "quote")[1]
 
-        except (NameError, AttributeError):
-            t = create_Thread(
-                target=self.quote_websocket,
-                args=[symbol_id],
-                name=symbol_id + "quote",
-            )
-            t.start()
-            print("new")
+    def get_version(self, symbol_id):
 
-    def get_first_quote_data(self, message):
+        self.watch(symbol_id)
 
-        symbol = message["data"]["info"]["symbolId"]
+        return self.manager.store.get(symbol_id, "quote")[0]
 
-        ask = message["data"]["quote"]["order"]["bestAsks"]
-        ask.reverse()
-        df_ask = pd.DataFrame(ask, columns=["price", "unit"]).rename(
-            columns={"unit": "ask_unit"}
-        )
+    def get_figure(self, symbol_id, key, build):
 
-        bid = message["data"]["quote"]["order"]["bestBids"]
-        bid.reverse()
-        df_bid = pd.DataFrame(bid, columns=["unit", "price"]).rename(
-            columns={"unit": "bid_unit"}
+        return self.figures.get(
+            (symbol_id, key), self.get_version(symbol_id), build
         )
 
-        df_quote = pd.merge(df_ask, df_bid, on="price", how="outer")
-        df_quote = df_quote[["bid_unit", "price", "ask_unit"]]
+    def get_trade_tape(self, symbol_id):
 
-        price_list = list(df_quote["price"])
+        self.watch(symbol_id)
 
-        return df_quote, price_list, symbol
+        return self.tapes[symbol_id]
 
-    def get_new_quote_data(self, message, df_quote):
+    def get_first_quote_data(self, message):
 
-        df_quote2, price_list, symbol = self.get_first_quote_data(message)
+        symbol = message["data"]["info"]["symbolId"]
+        book = self.watch(symbol)
 
-        df_quote = pd.concat([df_quote, df_quote2], axis=0).drop_duplicates(
-            subset="price", keep="last"
-        )
-        df_quote = df_quote.sort_values("price", ascending=False).reset_index(
-            drop=True
-        )
+        with book.lock:
+            book.reset(symbol)
 
-        return df_quote, price_list, symbol
+        return self.get_new_quote_data(message)
 
-    def update_quote_data(self, input_symbol):
+    def get_new_quote_data(self, message, df_quote=None):
 
-        global df_quote, symbol
+        # the book is the one watch() keeps with its tape and subscription
+        record = message_decoder.quote(message)
+        book = self.watch(record.symbol_id)
 
-        self.get_quote_msg(input_symbol)
+        with book.lock:
+            book.apply(record.bids, record.asks)
+            return book.to_frame(), book.price_list, record.symbol_id
 
-        try:
-            if input_symbol == symbol:
-                df_quote, price_list, symbol = self.get_new_quote_data(
-                    quote_msg, df_quote
-                )
-            else:
-                time.sleep(1)
-                df_quote, price_list, symbol = self.get_first_quote_data(
-                    quote_msg
-                )
-        except:
-            time.sleep(1)
-            df_quote, price_list, symbol = self.get_first_quote_data(quote_msg)
+    def update_quote_data(self, input_symbol):
 
-        return df_quote, price_list, symbol
+        book = self.watch(input_symbol)
+        sequence, record = self.manager.store.get(input_symbol, "quote")
 
-    def plot_order_book(self, dataframe, price_list, symbol_id):
+        if record is None:
+            # the new subscription has not delivered its first message yet
+            return (
+                pd.DataFrame(columns=["bid_unit", "price", "ask_unit"]),
+                [],
+                input_symbol,
+            )
 
-        rows = []
-        for i in range(len(dataframe)):
-            row = []
-            for col in dataframe.columns:
-                value = dataframe.iloc[i][col]
+        with book.lock:
+            # the same snapshot is never applied twice
+            if sequence != book.applied:
+                book.apply(record.bids, record.asks)
+                book.applied = sequence
 
-                if col == "price":
+            return book.to_frame(), book.price_list, input_symbol
 
-                    if value not in price_list:
+    def order_book_row(self, symbol_id, columns, values, active):
 
-                        cell = html.Td(
-                            html.A(
-                                href="https://www.fugle.tw/ai/" + symbol_id,
-                                children=value,
-                                style={"color": "gray"},
-                            ),
-                            style={"font-size": 16, "text-align": "center"},
-                        )
+        # NaN never equals itself, so it would miss the cache every time
+        key = (
+            symbol_id,
+            columns,
+            tuple(None if value != value else value for value in values),
+            active,
+        )
+        row = self.rows.get(key)
 
-                    elif value in price_list:
+        if row is None:
+            row = []
+            for col, value in zip(columns, values):
 
-                        cell = html.Td(
-                            html.A(
-                                href="https://www.fugle.tw/ai/" + symbol_id,
-                                children=value,
-                            ),
-                            style={"font-size": 16, "text-align": "center"},
-                        )
+                if col == "price":
+                    link = {
+                        "href": "https://www.fugle.tw/ai/" + symbol_id,
+                        "children": value,
+                    }
+                    if not active:
+                        link["style"] = {"color": "gray"}
+
+                    cell = html.Td(
+                        html.A(**link),
+                        style={"font-size": 16, "text-align": "center"},
+                    )
 
                 else:
                     cell = html.Td(
@@ -418,7 +1009,25 @@ class quote_websocket_api:
                     )
 
                 row.append(cell)
-            rows.append(html.Tr(row))
+
+            if len(self.rows) >= 1000:
+                self.rows.clear()
+            row = self.rows[key] = html.Tr(row)
+
+        return row
+
+    def plot_order_book(self, dataframe, price_list, symbol_id):
+
+        columns = tuple(dataframe.columns)
+        price_list = set(price_list)
+        price = columns.index("price")
+
+        rows = [
+            self.order_book_row(
+                symbol_id, columns, values, values[price] in price_list
+            )
+            for values in dataframe.itertuples(index=False, name=None)
+        ]
 
         return html.Table(
             [
@@ -434,4 +1043,323 @@ class quote_websocket_api:
             + rows
         )
 
-    _ws = quote_websocket
+    def plot_order_book_table(self, dataframe, price_list, symbol_id):
+
+        stale = np.flatnonzero(~dataframe["price"].isin(price_list))
+
+        return dash_table.DataTable(
+            id="order_book_table",
+            columns=[{"name": col, "id": col} for col in dataframe.columns],
+            data=dataframe.to_dict("records"),
+            style_cell={"font-size": 16, "text-align": "center"},
+            style_data_conditional=[
+                {
+                    "if": {"row_index": int(i), "column_id": "price"},
+                    "color": "gray",
+                }
+                for i in stale
+            ],
+        )
+
+    def plot_time_and_sales(self, dataframe):
+
+        return dash_table.DataTable(
+            id="time_and_sales_table",
+            columns=[{"name": col, "id": col} for col in dataframe.columns],
+            data=dataframe.to_dict("records"),
+            style_cell={"font-size": 16, "text-align": "center"},
+        )
+
+    def plot_volume_profile(self, dataframe, bar_color):
+
+        return {
+            "type": "bar",
+            "orientation": "h",
+            "x": dataframe["unit"],
+            "y": dataframe["price"],
+            "marker": {"color": bar_color},
+            "name": "volume_profile",
+        }
+
+
+class threshold_index:
+    def __init__(self, bound, rule):
+        order = np.argsort(bound, kind="stable")
+        self.bound = bound[order]
+        self.rule = rule[order]
+
+    def between(self, low, high, side):
+        # the rules whose bound a move from low to high has crossed, found
+        # by bisection instead of comparing every rule
+        return self.rule[
+            np.searchsorted(self.bound, low, side) : np.searchsorted(
+                self.bound, high, side
+            )
+        ]
+
+
+class tick_alert_engine:
+    def __init__(
+        self,
+        api_token,
+        notify,
+        rules,
+        hysteresis=0,
+        manager=None,
+        references=None,
+        retry=5,
+        max_retry=300,
+    ):
+        self.api_token = api_token
+        self.notify = notify
+        self.hysteresis = hysteresis
+        self.manager = manager or stream_manager.get(api_token)
+        self.retry = retry
+        self.max_retry = max_retry
+        self.symbols = set()
+        self.last_price = {}
+        self.references = {}
+        self.missing = set()
+        self.failures = 0
+        self.retry_at = 0
+        self.loading = False
+        self.lock = threading.RLock()
+        self.set_rules(rules, references)
+
+    def get_references(self, symbols):
+
+        # a symbol whose meta fails only holds back its own change rules
+        references = {}
+        for symbol_id in symbols:
+            try:
+                references[symbol_id] = intraday.meta(
+                    symbolId=symbol_id, apiToken=self.api_token, output="raw"
+                )["priceReference"]
+            except (
+                requests.RequestException,
+                ValueError,
+                KeyError,
+                TypeError,
+            ) as error:
+                metrics.error("get_references", (symbol_id, error))
+
+        return references
+
+    def set_rules(self, rules, references=None, date=None):
+
+        rules = pd.DataFrame(
+            rules, columns=["symbol_id", "type", "rise", "drop"]
+        ).reset_index(drop=True)
+        if references is None:
+            change = (rules["type"] == "change").to_numpy()
+            references = self.get_references(
+                rules.loc[change, "symbol_id"].unique()
+            )
+
+        with self.lock:
+            self.build(rules, references, date, reset=True)
+            self.failures = 0
+            self.backoff()
+
+    def build(self, rules, references, date=None, reset=False):
+
+        rise = rules["rise"].to_numpy(dtype=float)
+        drop = rules["drop"].to_numpy(dtype=float)
+        change = (rules["type"] == "change").to_numpy()
+        reference = rules["symbol_id"].map(references).to_numpy(dtype=float)
+
+        # a change rule is left out until its reference is known, as a NaN
+        # would sort past every bound and fire all of them on the first tick
+        valid = ~change | (np.isfinite(reference) & (reference != 0))
+        lower, rise_rearm, drop_rearm = alert_bounds(
+            change, rise, drop, reference, self.hysteresis
+        )
+
+        # a rule is armed again once the price is back inside its band by
+        # the hysteresis margin, and never while it is still past its bound
+        rise_rearm = np.minimum(
+            rise, alert_value(change, rise_rearm, reference)
+        )
+        drop_rearm = np.maximum(
+            lower, alert_value(change, drop_rearm, reference)
+        )
+
+        # the bounds are kept in the units of their rule, a change rule is
+        # compared with the change of the price, so a tick right on a bound
+        # alerts exactly as alert_engine would
+        indexes = {}
+        for symbol_id, rule in rules.groupby("symbol_id").indices.items():
+            indexes[symbol_id] = [
+                (
+                    reference[members[0]] if is_change else None,
+                    threshold_index(rise[members], members),
+                    threshold_index(lower[members], members),
+                    threshold_index(rise_rearm[members], members),
+                    threshold_index(drop_rearm[members], members),
+                )
+                for is_change in (False, True)
+                for members in [
+                    rule[(change[rule] == is_change) & valid[rule]]
+                ]
+                if len(members)
+            ]
+        loaded = set(rules.loc[change & valid, "symbol_id"])
+
+        with self.lock:
+            if reset:
+                # every rule starts armed, the first tick after the update
+                # checks them all
+                rise_armed = np.ones(len(rules), dtype=bool)
+                drop_armed = np.ones(len(rules), dtype=bool)
+                self.last_price = {}
+            else:
+                # the same rules with more references: the rules keep their
+                # state, and the next tick of a symbol whose change rules
+                # just joined checks all of its bounds
+                rise_armed, drop_armed = self.state[2:]
+                for symbol_id in loaded - set(self.references):
+                    self.last_price.pop(symbol_id, None)
+
+            self.rules = rules
+            self.date = date or datetime.date.today().isoformat()
+            self.references = {
+                symbol_id: references[symbol_id] for symbol_id in loaded
+            }
+            self.missing = set(rules.loc[change & ~valid, "symbol_id"])
+            self.state = (
+                rules.to_dict("list"),
+                indexes,
+                rise_armed,
+                drop_armed,
+            )
+            symbols = set(indexes)
+            for symbol_id in symbols - self.symbols:
+                self.manager.subscribe(symbol_id, "quote", self.on_message)
+            for symbol_id in self.symbols - symbols:
+                self.manager.unsubscribe(symbol_id, "quote", self.on_message)
+            self.symbols = symbols
+
+    def backoff(self):
+
+        # missing references are asked for again after a delay that doubles
+        # up to max_retry, so a failing meta is not hit on every trade
+        if self.missing:
+            self.failures += 1
+            self.retry_at = time.monotonic() + min(
+                self.max_retry, self.retry * 2 ** min(self.failures - 1, 32)
+            )
+        else:
+            self.failures = 0
+
+    def load(self, date):
+
+        # runs off the loop; the change rules of each symbol join in as
+        # soon as its reference is in
+        try:
+            references = self.get_references(sorted(self.missing))
+            with self.lock:
+                if date == self.date:
+                    self.build(
+                        self.rules, {**self.references, **references}, date
+                    )
+                    self.backoff()
+        finally:
+            self.loading = False
+
+    def alert_message(self, symbol_id, rule_type, side, target):
+
+        return alert_message(symbol_id, rule_type, side, target)
+
+    def evaluate(self, symbol_id, price):
+
+        rules, indexes, rise_armed, drop_armed = self.state
+        last = self.last_price.get(symbol_id)
+        self.last_price[symbol_id] = price
+        if price == last or symbol_id not in indexes:
+            return []
+
+        # only the bounds between the last trade and this one are read
+        rise_hit, drop_hit = [], []
+        for reference, rise, drop, rise_rearm, drop_rearm in indexes[
+            symbol_id
+        ]:
+            if reference is None:
+                value, last_value = price, last
+            else:
+                value = (price - reference) / reference
+                last_value = last and (last - reference) / reference
+
+            if last is None:
+                rise_hit.append(rise.between(-np.inf, value, "left"))
+                drop_hit.append(drop.between(value, np.inf, "right"))
+            elif price > last:
+                rearm = drop_rearm.between(last_value, value, "right")
+                drop_armed[rearm] = True
+                rise_hit.append(rise.between(last_value, value, "left"))
+            else:
+                rearm = rise_rearm.between(value, last_value, "left")
+                rise_armed[rearm] = True
+                drop_hit.append(drop.between(value, last_value, "right"))
+
+        rise_hit = np.concatenate(rise_hit or [np.empty(0, dtype=int)])
+        drop_hit = np.concatenate(drop_hit or [np.empty(0, dtype=int)])
+
+        # a rule alerts once until it is armed again
+        rise_new = rise_hit[rise_armed[rise_hit]]
+        drop_new = drop_hit[drop_armed[drop_hit]]
+        rise_armed[rise_new] = False
+        drop_armed[drop_new] = False
+
+        alerts = []
+        for side, column, new in (
+            (1, "rise", rise_new),
+            (-1, "drop", drop_new),
+        ):
+            for i in np.sort(new):
+                alerts.append(
+                    self.alert_message(
+                        rules["symbol_id"][i],
+                        rules["type"][i],
+                        side,
+                        rules[column][i],
+                    )
+                )
+
+        return alerts
+
+    def on_message(self, message):
+
+        trade = message["data"]["quote"].get("trade")
+        if not trade:
+            return
+
+        date = trade.get("at", "")[:10]
+        if date and date != self.date:
+            # a new trading day: the price rules go on at once, the change
+            # rules wait for the references of the day
+            with self.lock:
+                self.build(self.rules, {}, date, reset=True)
+                self.failures = 0
+                self.retry_at = 0
+
+        if (
+            self.missing
+            and not self.loading
+            and time.monotonic() >= self.retry_at
+        ):
+            self.loading = True
+            self.manager.loop.run_in_executor(None, self.load, self.date)
+
+        timer = metrics.start()
+        alerts = self.evaluate(
+            message["data"]["info"]["symbolId"], trade["price"]
+        )
+        if timer is not None:
+            metrics.stop("alert_evaluation_seconds", timer)
+            metrics.count("alerts_total", len(alerts))
+        for alert in alerts:
+            self.notify(alert)
+
+    def close(self):
+
+        self.set_rules([], {})